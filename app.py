@@ -1,15 +1,36 @@
-from flask import Flask, render_template, jsonify, send_file, request, session
+from flask import Flask, render_template, jsonify, send_file, request, session, g, Response, make_response, has_request_context
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
+import google_auth_httplib2
+import httplib2
 import os
 import csv
 import io
 import pandas as pd
 import numpy as np
 from dotenv import load_dotenv
-from functools import lru_cache
+from functools import wraps
 import time
-from datetime import datetime
+import hashlib
+import cProfile
+import marshal
+import random
+import bisect
+import heapq
+import threading
+import json
+import shutil
+import tempfile
+import secrets
+import sys
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+try:
+    import xlsxwriter
+except ImportError:  # XLSX export is optional
+    xlsxwriter = None
 
 load_dotenv()
 
@@ -23,16 +44,186 @@ SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
 SERVICE_ACCOUNT_FILE = 'credentials.json'
 SHEET_ID = os.getenv('GOOGLE_SHEET_ID')
 SHEET_NAME = os.getenv('GOOGLE_SHEET_NAME')
-CACHE_TIMEOUT = 300  # Cache timeout in seconds (5 minutes)
+CACHE_TIMEOUT = int(os.getenv('CACHE_TIMEOUT', 300))  # Cache timeout in seconds (5 minutes)
+# 'sync' refreshes expired sheet data inside the request, 'background' keeps serving the
+# last snapshot while a single background thread fetches the next one
+SHEET_REFRESH_MODE = os.getenv('SHEET_REFRESH_MODE', 'sync')
+SHEET_REFRESH_RETRY_DELAY = 30  # Seconds to wait before retrying a failed background refresh
+# 'full' re-reads every row on refresh, 'delta' only reads rows added since the last refresh
+SHEET_FETCH_MODE = os.getenv('SHEET_FETCH_MODE', 'full')
+SHEET_DELTA_OVERLAP = 50  # Already fetched tail rows re-read by a delta fetch to detect edits
+# Seconds after which a delta refresh does a full reload, to pick up edits above the tail
+SHEET_FULL_RELOAD_INTERVAL = int(os.getenv('SHEET_FULL_RELOAD_INTERVAL', 3600))
+# Local CSV with the sheet's header and rows, used instead of the Sheets API when set
+SHEET_FIXTURE_CSV = os.getenv('SHEET_FIXTURE_CSV')
+# Base URL of a Sheets API compatible server, such as `python local_sheets.py`, called without
+# credentials instead of the Google endpoint
+SHEETS_API_ENDPOINT = os.getenv('SHEETS_API_ENDPOINT')
+
+SHEETS_HTTP_TIMEOUT = 60  # Seconds before a Sheets API call times out
+TOKEN_REFRESH_MARGIN = 300  # Refresh the access token this many seconds before it expires
+
+# Server-side store for parsed uploads, referenced from the session by upload ID
+UPLOAD_TTL = int(os.getenv('UPLOAD_TTL', 3600))  # Seconds an unused upload is kept
+UPLOAD_STORE_MAX_BYTES = int(os.getenv('UPLOAD_STORE_MAX_BYTES', 256 * 1024 * 1024))
+UPLOAD_CHUNK_ROWS = 50000  # Uploaded CSV rows aggregated at a time
+SHEET_MEMO_MAX_ENTRIES = int(os.getenv('SHEET_MEMO_MAX_ENTRIES', 4096))
+SHEET_MEMO_MAX_BYTES = int(os.getenv('SHEET_MEMO_MAX_BYTES', 64 * 1024 * 1024))
+LANE_BATCH_MAX_LANES = 1000  # Most lanes accepted by one batch lane analysis request
+LANE_BATCH_WORKERS = int(os.getenv('LANE_BATCH_WORKERS', 4))  # Threads for parallel batch analysis
+
+# Background analysis of large uploads, started with /analyze_rates?async=1
+ANALYSIS_JOB_WORKERS = int(os.getenv('ANALYSIS_JOB_WORKERS', 2))
+ANALYSIS_JOB_TTL = int(os.getenv('ANALYSIS_JOB_TTL', 3600))  # Seconds a finished job is kept
+ANALYSIS_RESULTS_PAGE_SIZE = 100  # Lane differences per results page unless a limit is given
+ANALYSIS_RESULTS_MAX_PAGE_SIZE = 1000
+
+# Sort keys for pages of lane differences, by the name used in the sort query parameter
+LANE_DIFFERENCE_SORT_KEYS = {
+    'abs_difference': lambda lane: abs(lane['difference']),
+    'difference': lambda lane: lane['difference'],
+    'abs_difference_percent': lambda lane: abs(lane['difference_percent']),
+    'difference_percent': lambda lane: lane['difference_percent'],
+    'uploaded_rate': lambda lane: lane['uploaded_rate'],
+    'benchmark_rate': lambda lane: lane['benchmark_rate'],
+    'uploaded_count': lambda lane: lane['uploaded_count'],
+    'benchmark_count': lambda lane: lane['benchmark_count'],
+    'origin': lambda lane: str(lane['origin']),
+    'destination': lambda lane: str(lane['destination']),
+    'vehicle_type': lambda lane: str(lane['vehicle_type'])
+}
+
+# Lane difference fields and headings of exported files, in column order
+LANE_DIFFERENCE_EXPORT_COLUMNS = [
+    ('origin', 'Origin'),
+    ('destination', 'Destination'),
+    ('vehicle_type', 'Vehicle Type'),
+    ('uploaded_rate', 'Uploaded Rate'),
+    ('benchmark_rate', 'Benchmark Rate'),
+    ('difference', 'Difference'),
+    ('difference_percent', 'Difference %'),
+    ('uploaded_count', 'Uploaded Trips'),
+    ('benchmark_count', 'Benchmark Trips')
+]
+EXPORT_BATCH_ROWS = 1000  # Lanes written per chunk of a streamed export
+EXPORT_READ_BYTES = 64 * 1024  # Bytes read per chunk when streaming an export file from disk
+
+# On-disk copy of the last sheet snapshot so a fresh process can serve without fetching. It is
+# only used by a process configured for the same sheet. Set SHEET_SNAPSHOT_DIR to an empty
+# string to disable it.
+SNAPSHOT_DIR = os.getenv('SHEET_SNAPSHOT_DIR', os.path.join(tempfile.gettempdir(), 'prebid-intel-snapshot'))
+SNAPSHOT_MAX_AGE = int(os.getenv('SHEET_SNAPSHOT_MAX_AGE', 86400))  # Ignore disk snapshots older than this
+# 'process' keeps a sheet snapshot per process. 'shared' has one process per host refresh the
+# on-disk snapshot while every worker process maps the published files read-only.
+SHEET_SNAPSHOT_SHARING = os.getenv('SHEET_SNAPSHOT_SHARING', 'process')
+SHARED_SNAPSHOT_POLL_INTERVAL = 1  # Seconds between checks for a newer shared snapshot
+
+# Opt-in request profiling. With PROFILING=on, requests sent with the PROFILE_HEADER header and a
+# PROFILE_SAMPLE_RATE fraction of the rest run under cProfile, and the call stacks of any other
+# request are sampled so that one taking over PROFILE_SLOW_THRESHOLD seconds is kept too
+PROFILING = os.getenv('PROFILING', 'off')
+PROFILE_HEADER = 'X-Profile'
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_SLOW_THRESHOLD = float(os.getenv('PROFILE_SLOW_THRESHOLD', 0))  # 0 disables slow request profiles
+PROFILE_STACK_INTERVAL = 0.01  # Seconds between stack samples of a watched request
+PROFILE_MAX_ENTRIES = int(os.getenv('PROFILE_MAX_ENTRIES', 20))  # Most recent profiles kept
+
+# Seconds a shared cache such as the Vercel CDN may serve read responses that don't depend on
+# the session's upload. Browsers always revalidate them with their ETag.
+EDGE_CACHE_MAX_AGE = int(os.getenv('EDGE_CACHE_MAX_AGE', 60))
+# Deployment the ETags belong to, so a release with changed pages or responses invalidates them
+RELEASE_ID = os.getenv('VERCEL_GIT_COMMIT_SHA', '')
 
 # Sample file path
 SAMPLE_FILE_PATH = 'PRE BID INTEL SAMPLE.csv'
 
-# Cache for sheet data
+# Cache for sheet data. The snapshot holds the store and everything derived from it and is
+# replaced as a whole, so readers never see data and indexes from different refreshes.
 sheet_data_cache = {
-    'data': None,
-    'timestamp': 0
+    'snapshot': None,
+    'refreshing': False,
+    'last_refresh_started': 0,
+    'last_refresh_duration': None,
+    'last_refresh_error': None,
+    'disk_checked': False,
+    'shared_checked': 0,
+    'stats': {
+        'hits': 0,
+        'stale_hits': 0,
+        'misses': 0,
+        'refreshes': 0,
+        'refresh_errors': 0
+    }
+}
+sheet_refresh_lock = threading.Lock()
+shared_snapshot_lock = threading.Lock()
+
+# Process-wide Sheets client, built once and reused by every refresh
+sheets_client = {
+    'service': None,
+    'credentials': None,
+    'stats': {
+        'token_refreshes': 0,
+        'token_refresh_seconds': 0.0,
+        'api_calls': 0,
+        'api_call_seconds': 0.0,
+        'api_errors': 0,
+        'response_bytes': 0
+    }
 }
+sheets_client_lock = threading.Lock()
+
+# Uploads by ID, least recently used first
+upload_store = OrderedDict()
+upload_store_lock = threading.Lock()
+# Upload ID by (content hash, sheet version) of the stored uploads, so an unchanged file analyzed
+# against an unchanged sheet reuses the stored upload and results. Guarded by upload_store_lock.
+upload_fingerprints = {}
+
+# Upper bounds in seconds of the latency histogram buckets exported by /metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Request and Sheets API latency histograms and upload throughput counters for /metrics
+metrics = {
+    'routes': {},  # (route, method, status) -> latency histogram
+    'sheets_api': None,
+    'uploads': {
+        'count': 0,
+        'rows': 0,
+        'rejected_rows': 0,
+        'seconds': 0.0,
+        'last_rows_per_second': 0.0,
+        'cache_hits': 0,
+        'cache_misses': 0
+    }
+}
+metrics_lock = threading.Lock()
+
+# Captured request profiles by profile ID, oldest first
+profile_store = OrderedDict()
+profile_store_lock = threading.Lock()
+
+# Requests whose stacks the sampler thread is recording, by thread ID
+stack_sampler = {
+    'thread': None,
+    'requests': {}
+}
+stack_sampler_lock = threading.Lock()
+
+# Background analysis jobs by job ID, oldest first
+analysis_jobs = OrderedDict()
+analysis_jobs_lock = threading.Lock()
+analysis_job_executor = ThreadPoolExecutor(max_workers=ANALYSIS_JOB_WORKERS, thread_name_prefix='analysis-job')
+
+# Results derived from the sheet by (function name, *arguments), least recently used first,
+# all for the sheet version in 'version'
+sheet_memo = {
+    'version': None,
+    'entries': OrderedDict(),
+    'size': 0,
+    'stats': {}
+}
+sheet_memo_lock = threading.Lock()
 
 # Required columns for analysis
 REQUIRED_COLUMNS = {
@@ -44,6 +235,26 @@ REQUIRED_COLUMNS = {
     'Rating': None
 }
 
+# File names used for each store column in on-disk snapshots
+SNAPSHOT_FILE_NAMES = {
+    'Origin cluster name': 'origin',
+    'Destination cluster name': 'destination',
+    'Vehicle Type (New)': 'vehicle_type',
+    'Shipper': 'shipper',
+    'Transporter': 'transporter',
+    'Rating': 'rating'
+}
+
+# Column types in the benchmark store
+TEXT_COLUMNS = ['Origin cluster name', 'Destination cluster name', 'Vehicle Type (New)', 'Transporter']
+NUMERIC_COLUMNS = ['Shipper', 'Rating']
+
+# Columns that identify an ODVT (origin, destination, vehicle type) lane
+ODVT_COLUMNS = ['Origin cluster name', 'Destination cluster name', 'Vehicle Type (New)']
+
+# Uploaded CSV columns read by the analysis and filter endpoints; all others are skipped
+UPLOAD_COLUMNS = ODVT_COLUMNS + ['Shipper', 'Vehicle Type']
+
 # Rating categories
 RATING_CATEGORIES = {
     'Gold': 4.0,
@@ -51,8 +262,227 @@ RATING_CATEGORIES = {
     'Bronze': 0.0
 }
 
+def new_histogram():
+    """Create an empty latency histogram with a count per LATENCY_BUCKETS bucket plus +Inf"""
+    return {'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+
+def observe_latency(histogram, seconds):
+    """Add a duration to a histogram. Callers hold metrics_lock."""
+    histogram['buckets'][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    histogram['sum'] += seconds
+    histogram['count'] += 1
+
+def count_sheet_cache(outcome):
+    """Count a sheet snapshot lookup as a hit, stale hit or miss, or a refresh outcome"""
+    with metrics_lock:
+        sheet_data_cache['stats'][outcome] += 1
+
+metrics['sheets_api'] = new_histogram()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    """Add the request's duration to its route's latency histogram"""
+    start = g.get('request_start')
+    if start is not None:
+        seconds = time.perf_counter() - start
+        key = (request.url_rule.rule if request.url_rule else 'unmatched', request.method, response.status_code)
+        with metrics_lock:
+            histogram = metrics['routes'].get(key)
+            if histogram is None:
+                histogram = metrics['routes'][key] = new_histogram()
+            observe_latency(histogram, seconds)
+    return response
+
+@app.before_request
+def start_request_profile():
+    """Profile the request if it asked for it or is sampled, otherwise watch it for being slow"""
+    if PROFILING != 'on':
+        return
+    
+    if request.headers.get(PROFILE_HEADER):
+        trigger = 'header'
+    elif PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        trigger = 'sample'
+    else:
+        trigger = None
+    
+    if trigger is not None:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            g.profile = {'kind': 'cprofile', 'trigger': trigger, 'profiler': profiler}
+            return
+        except ValueError:
+            # Another profiler is active on this interpreter, fall back to watching for slowness
+            pass
+    
+    if PROFILE_SLOW_THRESHOLD > 0:
+        g.profile = {'kind': 'stack', 'trigger': 'slow', 'samples': watch_request_stacks()}
+
+@app.after_request
+def record_profile_status(response):
+    if g.get('profile') is not None:
+        g.profile['status'] = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_profile(error=None):
+    """Stop the request's profiler and keep the profile if it was requested, sampled or slow"""
+    profile = g.pop('profile', None)
+    if profile is None:
+        return
+    
+    if profile['kind'] == 'cprofile':
+        profile['profiler'].disable()
+        duration = time.perf_counter() - g.request_start
+        profile['profiler'].create_stats()
+        # Same format as pstats dump_stats, so the download opens with pstats or snakeviz
+        data = marshal.dumps(profile['profiler'].stats)
+        sample_count = None
+    else:
+        unwatch_request_stacks()
+        duration = time.perf_counter() - g.request_start
+        if duration < PROFILE_SLOW_THRESHOLD:
+            return
+        samples = profile['samples']
+        sample_count = sum(samples.values())
+        if sample_count == 0:
+            # The sampler never saw the request, e.g. it finished between two samples, and an
+            # empty profile would be indistinguishable from a real one in the store
+            return
+        # Collapsed stacks, one "outer;inner count" line per stack, as read by flamegraph tools
+        data = ''.join(f'{stack} {count}\n' for stack, count in samples.most_common()).encode('utf-8')
+    
+    save_profile({
+        'kind': profile['kind'],
+        'trigger': profile['trigger'],
+        'method': request.method,
+        'path': request.full_path if request.query_string else request.path,
+        'route': request.url_rule.rule if request.url_rule else None,
+        'status': profile.get('status', 500 if error is not None else None),
+        'duration_seconds': duration,
+        'sample_count': sample_count,
+        'timestamp': datetime.now().isoformat(),
+        'data': data
+    })
+
+def save_profile(profile):
+    """Add a profile to the store, dropping the oldest beyond PROFILE_MAX_ENTRIES"""
+    profile['id'] = secrets.token_urlsafe(8)
+    profile['size'] = len(profile['data'])
+    with profile_store_lock:
+        profile_store[profile['id']] = profile
+        while len(profile_store) > PROFILE_MAX_ENTRIES:
+            profile_store.popitem(last=False)
+
+def watch_request_stacks():
+    """Start sampling the current thread's stack, returning the Counter the samples go into"""
+    samples = Counter()
+    with stack_sampler_lock:
+        stack_sampler['requests'][threading.get_ident()] = samples
+        if stack_sampler['thread'] is None:
+            stack_sampler['thread'] = threading.Thread(target=sample_request_stacks, name='stack-sampler', daemon=True)
+            stack_sampler['thread'].start()
+    return samples
+
+def unwatch_request_stacks():
+    with stack_sampler_lock:
+        stack_sampler['requests'].pop(threading.get_ident(), None)
+
+def sample_request_stacks():
+    """Sampler thread: every PROFILE_STACK_INTERVAL, count the stack of each watched request.
+    Exits when no request is being watched and is restarted by the next one."""
+    while True:
+        time.sleep(PROFILE_STACK_INTERVAL)
+        frames = sys._current_frames()
+        with stack_sampler_lock:
+            if not stack_sampler['requests']:
+                stack_sampler['thread'] = None
+                return
+            for thread_id, samples in stack_sampler['requests'].items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[collapse_stack(frame)] += 1
+
+def collapse_stack(frame):
+    """Format a stack as "outermost;...;innermost", naming each function by its file and first line"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
 def get_google_sheets_service():
-    """Get Google Sheets service using either credentials file or environment variables"""
+    """Get the shared Google Sheets service, building it on first use and keeping its token fresh"""
+    with sheets_client_lock:
+        if sheets_client['service'] is None:
+            sheets_client['service'], sheets_client['credentials'] = build_google_sheets_service()
+        refresh_sheets_token_if_needed()
+        return sheets_client['service']
+
+def refresh_sheets_token_if_needed():
+    """Refresh the service account access token ahead of expiry. Callers hold sheets_client_lock."""
+    creds = sheets_client['credentials']
+    if creds is None:
+        return
+    
+    # google-auth keeps expiry as a naive UTC datetime
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    expires_soon = creds.expiry is None or (creds.expiry - now).total_seconds() < TOKEN_REFRESH_MARGIN
+    if creds.valid and not expires_soon:
+        return
+    
+    start = time.perf_counter()
+    creds.refresh(google_auth_httplib2.Request(httplib2.Http(timeout=SHEETS_HTTP_TIMEOUT)))
+    sheets_client['stats']['token_refreshes'] += 1
+    sheets_client['stats']['token_refresh_seconds'] += time.perf_counter() - start
+
+def execute_sheets_request(request):
+    """Execute a Sheets API request on the shared client, recording its duration"""
+    start = time.perf_counter()
+    
+    # Count the raw response body before the client decodes it
+    postproc = getattr(request, 'postproc', None)
+    if postproc is not None:
+        def count_response_bytes(resp, content):
+            sheets_client['stats']['response_bytes'] += len(content)
+            return postproc(resp, content)
+        request.postproc = count_response_bytes
+    
+    with sheets_client_lock:
+        try:
+            return request.execute()
+        except Exception:
+            sheets_client['stats']['api_errors'] += 1
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            sheets_client['stats']['api_calls'] += 1
+            sheets_client['stats']['api_call_seconds'] += seconds
+            with metrics_lock:
+                observe_latency(metrics['sheets_api'], seconds)
+
+def build_google_sheets_service():
+    """Build a Sheets service and its credentials using either credentials file or environment variables.
+    
+    The service keeps one authorized HTTP client so connections are reused between calls.
+    """
+    if SHEET_FIXTURE_CSV:
+        from local_sheets import LocalSheetsService
+        return LocalSheetsService.from_csv(SHEET_FIXTURE_CSV), None
+    
+    if SHEETS_API_ENDPOINT:
+        service = build('sheets', 'v4',
+                        http=httplib2.Http(timeout=SHEETS_HTTP_TIMEOUT),
+                        client_options={'api_endpoint': SHEETS_API_ENDPOINT},
+                        cache_discovery=False)
+        return service, None
+    
     try:
         # Try to get individual credential components from environment variables
         private_key = os.getenv('GOOGLE_SHEETS_PRIVATE_KEY')
@@ -87,28 +517,339 @@ def get_google_sheets_service():
                 scopes=SCOPES
             )
         
-        service = build('sheets', 'v4', credentials=creds, cache_discovery=True)
-        return service
+        authorized_http = google_auth_httplib2.AuthorizedHttp(
+            creds,
+            http=httplib2.Http(timeout=SHEETS_HTTP_TIMEOUT)
+        )
+        service = build('sheets', 'v4', http=authorized_http, cache_discovery=False)
+        return service, creds
     except Exception as e:
         print(f"Error getting Google Sheets service: {str(e)}")  # Debug log
         raise
 
-def get_sheet_data():
-    # Check if cache is valid
-    current_time = time.time()
-    if sheet_data_cache['data'] is not None and current_time - sheet_data_cache['timestamp'] < CACHE_TIMEOUT:
-        return sheet_data_cache['data']
+def get_sheet_snapshot():
+    """Get the current sheet snapshot, see find_sheet_snapshot.
+    
+    Within a request the first snapshot found is kept in g and returned again, so the request
+    reads one sheet version throughout and counts as one sheet cache lookup in /metrics.
+    """
+    if not has_request_context():
+        return find_sheet_snapshot()
+    snapshot = g.get('sheet_snapshot')
+    if snapshot is None:
+        snapshot = g.sheet_snapshot = find_sheet_snapshot()
+    return snapshot
+
+def find_sheet_snapshot():
+    """Get the current sheet snapshot, refreshing it first if it is missing or expired.
+    
+    In background mode an expired snapshot is still returned while a refresh runs. Only one
+    refresh runs at a time, so concurrent requests never fetch from the API together. On the
+    first call in a process the snapshot saved on disk is used if there is one, and it is
+    revalidated in the background when expired.
+    """
+    if SHEET_SNAPSHOT_SHARING == 'shared' and SNAPSHOT_DIR:
+        return get_shared_sheet_snapshot()
+    
+    snapshot = sheet_data_cache['snapshot']
+    if snapshot is None and not sheet_data_cache['disk_checked']:
+        snapshot = load_disk_snapshot_once()
+    
+    if snapshot is not None and time.time() - snapshot['timestamp'] < CACHE_TIMEOUT:
+        count_sheet_cache('hits')
+        return snapshot
+    
+    if snapshot is not None and (SHEET_REFRESH_MODE == 'background' or snapshot['source'] == 'disk'):
+        count_sheet_cache('stale_hits')
+        start_background_refresh()
+        return snapshot
+    
+    with sheet_refresh_lock:
+        # Another request may have refreshed the data while we waited for the lock
+        snapshot = sheet_data_cache['snapshot']
+        if snapshot is None or time.time() - snapshot['timestamp'] >= CACHE_TIMEOUT:
+            count_sheet_cache('misses')
+            refresh_sheet_data()
+        else:
+            count_sheet_cache('hits')
+        return sheet_data_cache['snapshot']
+
+def get_shared_sheet_snapshot():
+    """Get the snapshot published in SNAPSHOT_DIR by whichever process refreshed it last.
+    
+    New versions are picked up within SHARED_SNAPSHOT_POLL_INTERVAL. When the published
+    snapshot expires, the first process to take the host-wide refresh lock fetches the next
+    one in the background. The others keep serving the current one meanwhile.
+    """
+    snapshot = sheet_data_cache['snapshot']
+    if snapshot is None or time.time() - sheet_data_cache['shared_checked'] >= SHARED_SNAPSHOT_POLL_INTERVAL:
+        snapshot = load_shared_snapshot()
+    
+    if snapshot is not None and time.time() - snapshot['timestamp'] < CACHE_TIMEOUT:
+        count_sheet_cache('hits')
+        return snapshot
+    
+    if snapshot is not None:
+        count_sheet_cache('stale_hits')
+        start_background_refresh()
+        return snapshot
+    
+    # Nothing published yet, so fetch it or wait for the process that is fetching it
+    count_sheet_cache('misses')
+    with sheet_refresh_lock:
+        refresh_shared_snapshot(blocking=True)
+        return sheet_data_cache['snapshot']
+
+def load_shared_snapshot():
+    """Swap in the published on-disk snapshot if it is newer than the one in memory"""
+    with shared_snapshot_lock:
+        sheet_data_cache['shared_checked'] = time.time()
+        snapshot = sheet_data_cache['snapshot']
+        try:
+            # Never go back to an older snapshot, e.g. when publishing our own refresh failed
+            current = read_snapshot_pointer()
+            if current is None or (snapshot is not None and current['timestamp'] < snapshot['timestamp']):
+                return snapshot
+            if snapshot is not None and snapshot['source'] == 'disk' and snapshot['version'] == current['version']:
+                # Same data refetched by another process, so only its fetch time moved on
+                if current['timestamp'] > snapshot['timestamp']:
+                    snapshot = dict(snapshot, timestamp=current['timestamp'], fetch_state=current.get('fetch_state'))
+                    sheet_data_cache['snapshot'] = snapshot
+                return snapshot
+            
+            disk_snapshot = load_snapshot_from_disk(snapshot)
+            if disk_snapshot is not None:
+                sheet_data_cache['snapshot'] = snapshot = disk_snapshot
+        except Exception as e:
+            print(f"Error loading shared sheet snapshot: {str(e)}")
+        return snapshot
+
+def refresh_shared_snapshot(blocking, force=False):
+    """Refresh the sheet and publish it for all processes, unless another process holds the
+    host-wide refresh lock or, without force, has just published a fresh snapshot.
+    Callers must hold sheet_refresh_lock."""
+    import fcntl
+    
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    with open(os.path.join(SNAPSHOT_DIR, 'refresh.lock'), 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Another process is refreshing; its snapshot is picked up once published
+            return
+        
+        try:
+            if force:
+                # Fetch in full rather than continuing from the current snapshot
+                sheet_data_cache['snapshot'] = None
+            else:
+                # Another process may have published a fresh snapshot while we waited for the lock
+                snapshot = load_shared_snapshot()
+                if snapshot is not None and time.time() - snapshot['timestamp'] < CACHE_TIMEOUT:
+                    return
+            refresh_sheet_data()
+            share_published_store()
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def share_published_store():
+    """Swap the columns of the snapshot this process just refreshed and published for their
+    memory-mapped copies, like the other processes serve, keeping the indexes and aggregates
+    already built. Callers must hold sheet_refresh_lock."""
+    snapshot = sheet_data_cache['snapshot']
+    current = read_snapshot_pointer()
+    if current is None or current['version'] != snapshot['version'] or current['timestamp'] != snapshot['timestamp']:
+        # Publishing failed, so keep serving the fetched copy
+        return
+    
+    try:
+        store = load_store_from_disk(snapshot['version'])
+    except Exception as e:
+        print(f"Error loading published sheet snapshot: {str(e)}")
+        return
+    with shared_snapshot_lock:
+        sheet_data_cache['snapshot'] = dict(snapshot, data=store, source='disk')
+        sheet_data_cache['shared_checked'] = time.time()
+
+def load_disk_snapshot_once():
+    """Load the on-disk snapshot into the cache the first time the process needs sheet data"""
+    with sheet_refresh_lock:
+        if sheet_data_cache['snapshot'] is None and not sheet_data_cache['disk_checked']:
+            sheet_data_cache['disk_checked'] = True
+            try:
+                sheet_data_cache['snapshot'] = load_snapshot_from_disk()
+            except Exception as e:
+                print(f"Error loading sheet snapshot from disk: {str(e)}")
+        return sheet_data_cache['snapshot']
+
+def start_background_refresh():
+    """Start a background sheet refresh unless one is running or the last one just failed"""
+    if (sheet_data_cache['last_refresh_error'] is not None 
+            and time.time() - sheet_data_cache['last_refresh_started'] < SHEET_REFRESH_RETRY_DELAY):
+        return
+    if not sheet_refresh_lock.acquire(blocking=False):
+        return
+    
+    def run_refresh():
+        try:
+            if SHEET_SNAPSHOT_SHARING == 'shared' and SNAPSHOT_DIR:
+                refresh_shared_snapshot(blocking=False)
+            else:
+                refresh_sheet_data()
+        except Exception as e:
+            print(f"Error refreshing sheet data in background: {str(e)}")
+        finally:
+            sheet_refresh_lock.release()
+    
+    threading.Thread(target=run_refresh, daemon=True).start()
+
+def refresh_sheet_data():
+    """Fetch a new sheet snapshot and swap it in. Callers must hold sheet_refresh_lock."""
+    sheet_data_cache['refreshing'] = True
+    sheet_data_cache['last_refresh_started'] = time.time()
+    start = time.perf_counter()
+    try:
+        snapshot = fetch_sheet_snapshot(sheet_data_cache['snapshot'])
+        sheet_data_cache['snapshot'] = snapshot
+        sheet_data_cache['last_refresh_error'] = None
+        count_sheet_cache('refreshes')
+    except Exception as e:
+        sheet_data_cache['last_refresh_error'] = str(e)
+        count_sheet_cache('refresh_errors')
+        raise
+    finally:
+        sheet_data_cache['last_refresh_duration'] = time.perf_counter() - start
+        sheet_data_cache['refreshing'] = False
+    
+    try:
+        save_snapshot_to_disk(snapshot)
+    except Exception as e:
+        print(f"Error saving sheet snapshot to disk: {str(e)}")
+
+def save_snapshot_to_disk(snapshot):
+    """Write the snapshot's columns as .npy files under a directory named by its version.
+    
+    The CURRENT file, replaced atomically, names the sheet, the live version and its fetch
+    time, so readers never see a partially written snapshot or one of another sheet.
+    """
+    if not SNAPSHOT_DIR:
+        return
+    
+    store = snapshot['data']
+    version_dir = os.path.join(SNAPSHOT_DIR, snapshot['version'])
+    if not os.path.isdir(version_dir):
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(prefix=f'.{snapshot["version"]}-', dir=SNAPSHOT_DIR)
+        for col_name, file_name in SNAPSHOT_FILE_NAMES.items():
+            np.save(os.path.join(temp_dir, f'{file_name}.npy'), store['columns'][col_name])
+        with open(os.path.join(temp_dir, 'meta.json'), 'w') as meta_file:
+            json.dump({
+                'size': store['size'],
+                'categories': {col_name: store['categories'][col_name].tolist() for col_name in TEXT_COLUMNS}
+            }, meta_file)
+        try:
+            os.rename(temp_dir, version_dir)
+        except OSError:
+            # Another process wrote the same version first
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    
+    current_path = os.path.join(SNAPSHOT_DIR, 'CURRENT')
+    temp_path = f'{current_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as current_file:
+        json.dump({
+            'sheet': get_sheet_source(),
+            'version': snapshot['version'],
+            'timestamp': snapshot['timestamp'],
+            'fetch_state': snapshot.get('fetch_state')
+        }, current_file)
+    os.replace(temp_path, current_path)
+    
+    # Keep the live version and the one before it, which other processes may still be reading
+    version_dirs = sorted(
+        (entry for entry in os.scandir(SNAPSHOT_DIR) if entry.is_dir() and not entry.name.startswith('.')),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True
+    )
+    for entry in version_dirs[2:]:
+        if entry.name != snapshot['version']:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+def get_sheet_source():
+    """Identify the sheet that snapshots are fetched from: its ID, tab name and where it is read"""
+    if SHEET_FIXTURE_CSV:
+        source = f'fixture:{os.path.abspath(SHEET_FIXTURE_CSV)}'
+    elif SHEETS_API_ENDPOINT:
+        source = f'endpoint:{SHEETS_API_ENDPOINT}'
+    else:
+        source = 'google'
+    return {'sheet_id': SHEET_ID, 'sheet_name': SHEET_NAME, 'source': source}
+
+def read_snapshot_pointer():
+    """Read the CURRENT file naming the live on-disk snapshot, or None if there is none or it
+    was fetched from another sheet than the one this process is configured for"""
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, 'CURRENT')) as current_file:
+            current = json.load(current_file)
+    except FileNotFoundError:
+        return None
+    
+    if current.get('sheet') != get_sheet_source():
+        return None
+    return current
+
+def load_snapshot_from_disk(previous_snapshot=None):
+    """Load the live on-disk snapshot with its columns memory-mapped read-only, or None.
+    A snapshot of another sheet counts as missing, so the sheet is fetched in full instead."""
+    if not SNAPSHOT_DIR:
+        return None
+    
+    current = read_snapshot_pointer()
+    if current is None:
+        return None
+    
+    if time.time() - current['timestamp'] > SNAPSHOT_MAX_AGE:
+        return None
+    
+    store = load_store_from_disk(current['version'])
+    snapshot = build_sheet_snapshot(store, previous_snapshot, current['timestamp'], version=current['version'], source='disk')
+    if current.get('fetch_state'):
+        snapshot['fetch_state'] = current['fetch_state']
+    return snapshot
+
+def load_store_from_disk(version):
+    """Load a version's store from SNAPSHOT_DIR with its columns memory-mapped read-only"""
+    version_dir = os.path.join(SNAPSHOT_DIR, version)
+    with open(os.path.join(version_dir, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
     
-    # Fetch new data if cache is invalid
+    store = {
+        'size': meta['size'],
+        'columns': {
+            col_name: np.load(os.path.join(version_dir, f'{file_name}.npy'), mmap_mode='r')
+            for col_name, file_name in SNAPSHOT_FILE_NAMES.items()
+        },
+        'categories': {}
+    }
+    for col_name in TEXT_COLUMNS:
+        categories = np.empty(len(meta['categories'][col_name]), dtype=object)
+        categories[:] = meta['categories'][col_name]
+        store['categories'][col_name] = categories
+    return store
+
+def fetch_sheet_snapshot(previous_snapshot):
+    """Fetch the sheet from Google and build a new snapshot with its derived indexes"""
+    fetch_time = time.time()
+    
+    # Fetch new data
     service = get_google_sheets_service()
     sheet = service.spreadsheets()
     
     # Get header row first
-    header_result = sheet.values().get(
+    header_result = execute_sheets_request(sheet.values().get(
         spreadsheetId=SHEET_ID,
         range=f'{SHEET_NAME}!A1:Z1',
         majorDimension='ROWS'
-    ).execute()
+    ))
     
     headers = header_result.get('values', [[]])[0]
     
@@ -124,85 +865,793 @@ def get_sheet_data():
     if missing_columns:
         raise ValueError(f"Required columns missing in sheet: {', '.join(missing_columns)}")
     
-    # Now get all data
-    result = sheet.values().get(
+    if SHEET_FETCH_MODE == 'delta':
+        snapshot = fetch_sheet_delta(sheet, headers, column_indices, previous_snapshot, fetch_time)
+        if snapshot is not None:
+            return snapshot
+    
+    # Now get all data for the required columns
+    fetch_stats = {}
+    columns, row_count = fetch_sheet_columns(sheet, column_indices, 2, fetch_stats)
+    
+    parse_start = time.perf_counter()
+    store = build_benchmark_store(collect_sheet_columns(columns, column_indices))
+    snapshot = build_sheet_snapshot(store, previous_snapshot, fetch_time)
+    fetch_stats['parse_seconds'] = time.perf_counter() - parse_start
+    
+    snapshot['fetch_state'] = build_fetch_state(headers, columns, row_count, 'full', fetch_time, row_count, fetch_stats)
+    return snapshot
+
+def fetch_sheet_delta(sheet, headers, column_indices, previous_snapshot, fetch_time):
+    """Fetch only the rows added since previous_snapshot and append them to its store.
+    
+    The last SHEET_DELTA_OVERLAP rows already fetched are read again and compared with their
+    checksum. Returns None when a full reload is needed instead: there is no earlier fetch to
+    continue from, the header or the tail rows changed, or the last full reload is too old.
+    """
+    fetch_state = previous_snapshot.get('fetch_state') if previous_snapshot else None
+    if fetch_state is None or fetch_state['header'] != headers:
+        return None
+    if fetch_time - fetch_state['full_fetch_time'] > SHEET_FULL_RELOAD_INTERVAL:
+        return None
+    
+    # Data starts on sheet row 2, so the overlap starts at row 2 + rows - overlap
+    overlap = min(SHEET_DELTA_OVERLAP, fetch_state['sheet_rows'])
+    first_row = fetch_state['sheet_rows'] - overlap + 2
+    fetch_stats = {}
+    columns, row_count = fetch_sheet_columns(sheet, column_indices, first_row, fetch_stats)
+    if row_count < overlap or compute_rows_checksum(columns, 0, overlap) != fetch_state['tail_checksum']:
+        return None
+    
+    parse_start = time.perf_counter()
+    new_rows = collect_sheet_columns(
+        {col_name: values[overlap:] for col_name, values in columns.items()}, column_indices
+    )
+    previous_store = previous_snapshot['data']
+    if len(new_rows['Shipper']):
+        store = append_to_store(previous_store, new_rows)
+        snapshot = build_sheet_snapshot(store, previous_snapshot, fetch_time, appended_start=previous_store['size'])
+    else:
+        snapshot = dict(previous_snapshot, timestamp=fetch_time, source='sheets')
+    fetch_stats['parse_seconds'] = time.perf_counter() - parse_start
+    
+    snapshot['fetch_state'] = build_fetch_state(
+        headers, columns, fetch_state['sheet_rows'] + row_count - overlap, 'delta',
+        fetch_state['full_fetch_time'], row_count - overlap, fetch_stats
+    )
+    return snapshot
+
+def column_letter(index):
+    """Convert a zero-based column index to its letter, like 'A' or 'AB'"""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+def fetch_sheet_columns(sheet, column_indices, first_row, fetch_stats):
+    """Fetch the required columns from first_row down with one column-major batchGet.
+    
+    Returns the raw values of each column, padded with '' to the same length since the API
+    trims trailing empty cells, and that length. Request time and response bytes are added
+    to fetch_stats.
+    """
+    col_names = list(column_indices)
+    ranges = []
+    for col_name in col_names:
+        letter = column_letter(column_indices[col_name])
+        ranges.append(f'{SHEET_NAME}!{letter}{first_row}:{letter}')
+    
+    request_start = time.perf_counter()
+    response_bytes = sheets_client['stats']['response_bytes']
+    result = execute_sheets_request(sheet.values().batchGet(
         spreadsheetId=SHEET_ID,
-        range=f'{SHEET_NAME}!A2:Z',
-        majorDimension='ROWS',
+        ranges=ranges,
+        majorDimension='COLUMNS',
         valueRenderOption='UNFORMATTED_VALUE'
-    ).execute()
+    ))
+    fetch_stats['request_seconds'] = time.perf_counter() - request_start
+    fetch_stats['response_bytes'] = sheets_client['stats']['response_bytes'] - response_bytes
     
-    data = result.get('values', [])
-    processed_data = []
+    value_ranges = result.get('valueRanges', [])
+    values = [(value_range.get('values') or [[]])[0] for value_range in value_ranges]
+    row_count = max((len(column) for column in values), default=0)
+    columns = {
+        col_name: column + [''] * (row_count - len(column))
+        for col_name, column in zip(col_names, values)
+    }
+    return columns, row_count
+
+def collect_sheet_columns(columns, column_indices):
+    """Get the fetched columns as object arrays, skipping rows whose required cells are all empty"""
+    collected = {}
+    for col_name in column_indices:
+        values = np.empty(len(columns[col_name]), dtype=object)
+        values[:] = columns[col_name]
+        collected[col_name] = values
     
-    for row in data:
-        # Skip empty rows
-        if not row:
-            continue
+    keep = np.zeros(len(next(iter(collected.values()), [])), dtype=bool)
+    for values in collected.values():
+        keep |= values != ''
+    return {col_name: values[keep] for col_name, values in collected.items()}
+
+def compute_rows_checksum(columns, start, stop):
+    """Hash rows start to stop of the fetched columns, so edits to already fetched rows can be detected"""
+    return hashlib.sha1(repr([values[start:stop] for values in columns.values()]).encode('utf-8')).hexdigest()
+
+def build_fetch_state(headers, columns, sheet_rows, kind, full_fetch_time, rows_fetched, fetch_stats):
+    """Record where a fetch ended, for the next delta fetch to continue from.
+    
+    columns hold the last rows fetched, ending at sheet_rows data rows into the sheet.
+    """
+    row_count = len(next(iter(columns.values()), []))
+    return dict(fetch_stats, **{
+        'kind': kind,
+        'header': headers,
+        'sheet_rows': sheet_rows,
+        'rows_fetched': rows_fetched,
+        'tail_checksum': compute_rows_checksum(columns, max(row_count - SHEET_DELTA_OVERLAP, 0), row_count),
+        'full_fetch_time': full_fetch_time
+    })
+
+def build_sheet_snapshot(store, previous_snapshot, timestamp, version=None, source='sheets', appended_start=None):
+    """Build a snapshot of the store together with the indexes and aggregates derived from it.
+    
+    When the store is previous_snapshot's store with rows appended from appended_start on,
+    the previous lane index is extended rather than rebuilt.
+    """
+    if previous_snapshot is not None:
+        benchmark_aggregates = refresh_benchmark_aggregates(
+            previous_snapshot['data'], previous_snapshot['benchmark_aggregates'], store
+        )
+    else:
+        benchmark_aggregates = aggregate_benchmark_rates(store)
+    
+    if appended_start is not None:
+        lane_index = extend_lane_index(previous_snapshot['lane_index'], store, appended_start)
+    else:
+        lane_index = build_lane_index(store)
+    
+    return {
+        'data': store,
+        'lane_index': lane_index,
+        'benchmark_aggregates': benchmark_aggregates,
+        'version': version or compute_store_version(store),
+        'timestamp': timestamp,
+        'source': source
+    }
+
+def parse_float_column(values):
+    """Parse raw sheet or CSV values to a float64 array, using NaN where a value is not numeric"""
+    parsed = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce')
+    return parsed.to_numpy(dtype=np.float64, na_value=np.nan)
+
+def build_benchmark_store(columns):
+    """Build the columnar benchmark store from raw values of the required columns.
+    
+    Text columns are dictionary-encoded as int32 codes into a categories array and
+    numeric columns are parsed once into float64 arrays with NaN for invalid values.
+    """
+    store = {
+        'size': len(columns['Shipper']),
+        'columns': {},
+        'categories': {}
+    }
+    
+    for col_name in TEXT_COLUMNS:
+        values = np.empty(len(columns[col_name]), dtype=object)
+        values[:] = columns[col_name]
+        codes, categories = pd.factorize(values, use_na_sentinel=False)
+        store['columns'][col_name] = codes.astype(np.int32)
+        store['categories'][col_name] = np.asarray(categories, dtype=object)
+    
+    for col_name in NUMERIC_COLUMNS:
+        store['columns'][col_name] = parse_float_column(columns[col_name])
+    
+    return store
+
+def append_to_store(store, columns):
+    """Build a new store from store with rows from raw values of the required columns appended,
+    encoded exactly as build_benchmark_store would encode all the rows together"""
+    new_store = {
+        'size': store['size'] + len(columns['Shipper']),
+        'columns': {},
+        'categories': {}
+    }
+    
+    for col_name in TEXT_COLUMNS:
+        # Factorizing the existing categories first keeps their codes and appends new names
+        categories = store['categories'][col_name]
+        values = np.empty(len(categories) + len(columns[col_name]), dtype=object)
+        values[:len(categories)] = categories
+        values[len(categories):] = columns[col_name]
+        codes, new_categories = pd.factorize(values, use_na_sentinel=False)
+        new_store['columns'][col_name] = np.concatenate([
+            store['columns'][col_name], codes[len(categories):].astype(np.int32)
+        ])
+        new_store['categories'][col_name] = np.asarray(new_categories, dtype=object)
+    
+    for col_name in NUMERIC_COLUMNS:
+        new_store['columns'][col_name] = np.concatenate([
+            store['columns'][col_name], parse_float_column(columns[col_name])
+        ])
+    
+    return new_store
+
+def compute_store_version(store):
+    """Hash the store contents into a short version string that changes whenever the data does"""
+    digest = hashlib.sha1()
+    for col_name in TEXT_COLUMNS:
+        digest.update(repr(store['categories'][col_name].tolist()).encode('utf-8'))
+        digest.update(store['columns'][col_name].tobytes())
+    for col_name in NUMERIC_COLUMNS:
+        digest.update(store['columns'][col_name].tobytes())
+    return digest.hexdigest()[:16]
+
+def get_appended_start(previous_store, store):
+    """Get the previous row count if store only appends rows to previous_store, otherwise None"""
+    if previous_store is None or store['size'] < previous_store['size']:
+        return None
+    
+    previous_size = previous_store['size']
+    for col_name in TEXT_COLUMNS:
+        previous_categories = previous_store['categories'][col_name]
+        categories = store['categories'][col_name][:len(previous_categories)]
+        if len(categories) < len(previous_categories) or not np.array_equal(categories, previous_categories):
+            return None
+        if not np.array_equal(store['columns'][col_name][:previous_size], previous_store['columns'][col_name]):
+            return None
+    
+    for col_name in NUMERIC_COLUMNS:
+        if not np.array_equal(store['columns'][col_name][:previous_size], previous_store['columns'][col_name], equal_nan=True):
+            return None
+    
+    return previous_size
+
+def group_positions(keys):
+    """Map each distinct integer key to the ascending array of positions where it occurs"""
+    if len(keys) == 0:
+        return {}
+
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    return dict(zip(sorted_keys[starts].tolist(), np.split(order, starts[1:])))
+
+def build_lane_index(store, start=0):
+    """Group row positions by origin -> destination -> vehicle type, keeping sheet order.
+    
+    Only rows from position start onwards are indexed.
+    """
+    origins = store['categories']['Origin cluster name']
+    destinations = store['categories']['Destination cluster name']
+    vehicle_types = store['categories']['Vehicle Type (New)']
+    
+    # Combine the codes into one integer key per lane and per lane + vehicle type
+    lane_keys = (store['columns']['Origin cluster name'][start:].astype(np.int64) * len(destinations) 
+                 + store['columns']['Destination cluster name'][start:])
+    vehicle_keys = lane_keys * len(vehicle_types) + store['columns']['Vehicle Type (New)'][start:]
+    
+    lane_index = {}
+    for lane_key, positions in group_positions(lane_keys).items():
+        if start:
+            positions = positions + start
+        origin_code, destination_code = divmod(lane_key, len(destinations))
+        lane_index.setdefault(origins[origin_code], {})[destinations[destination_code]] = {
+            'positions': positions,
+            'vehicle_types': {}
+        }
+    
+    for vehicle_key, positions in group_positions(vehicle_keys).items():
+        if start:
+            positions = positions + start
+        lane_key, vehicle_code = divmod(vehicle_key, len(vehicle_types))
+        origin_code, destination_code = divmod(lane_key, len(destinations))
+        lane = lane_index[origins[origin_code]][destinations[destination_code]]
+        lane['vehicle_types'][vehicle_types[vehicle_code]] = positions
+    
+    return lane_index
+
+def extend_lane_index(lane_index, store, start):
+    """Get a copy of lane_index, built for the rows before start, with the later rows added.
+    The lanes of lane_index are not modified, as older snapshots may still be reading them."""
+    extended = {origin: dict(destinations) for origin, destinations in lane_index.items()}
+    for origin, destinations in build_lane_index(store, start).items():
+        for destination, appended in destinations.items():
+            lane = extended.setdefault(origin, {}).get(destination)
+            if lane is None:
+                extended[origin][destination] = appended
+                continue
             
-        # Create row dict with only required columns
-        row_dict = {}
-        valid_row = True
+            vehicle_types = dict(lane['vehicle_types'])
+            for vehicle_type, positions in appended['vehicle_types'].items():
+                if vehicle_type in vehicle_types:
+                    positions = np.concatenate([vehicle_types[vehicle_type], positions])
+                vehicle_types[vehicle_type] = positions
+            extended[origin][destination] = {
+                'positions': np.concatenate([lane['positions'], appended['positions']]),
+                'vehicle_types': vehicle_types
+            }
+    return extended
+
+def get_lane_positions(snapshot, origin, destination, vehicle_type=None):
+    """Get the store positions of all rows for an origin-destination lane in sheet order,
+    optionally only those for one vehicle type"""
+    lane = snapshot['lane_index'].get(origin, {}).get(destination)
+    if lane and vehicle_type is not None:
+        positions = lane['vehicle_types'].get(vehicle_type)
+        return positions if positions is not None else np.empty(0, dtype=np.int64)
+    return lane['positions'] if lane else np.empty(0, dtype=np.int64)
+
+def memoize_per_sheet_version(func):
+    """Cache a function's results for the current sheet version in sheet_memo, so they are
+    dropped when the sheet changes and evicted least recently used past the memo's bounds.
+    
+    The function is called with the snapshot as its first argument, so the result is computed
+    from the version it is stored under. Callers leave it out, or pass snapshot= to use one
+    they already hold.
+    """
+    name = func.__name__
+    
+    @wraps(func)
+    def wrapper(*args, snapshot=None):
+        if snapshot is None:
+            snapshot = get_sheet_snapshot()
+        version = snapshot['version']
+        key = (name,) + args
+        with sheet_memo_lock:
+            if sheet_memo['version'] != version:
+                clear_sheet_memo(version)
+            stats = sheet_memo['stats'].setdefault(name, {'hits': 0, 'misses': 0, 'evictions': 0})
+            entry = sheet_memo['entries'].get(key)
+            if entry is not None:
+                sheet_memo['entries'].move_to_end(key)
+                stats['hits'] += 1
+                return entry['value']
+            stats['misses'] += 1
         
-        for col_name, col_index in column_indices.items():
-            # Check if the row has enough columns
-            if col_index < len(row):
-                row_dict[col_name] = row[col_index]
+        value = func(snapshot, *args)
+        size = approximate_size(value)
+        with sheet_memo_lock:
+            # Skip storing if the sheet changed or another request filled the entry meanwhile
+            if sheet_memo['version'] == version and key not in sheet_memo['entries']:
+                sheet_memo['entries'][key] = {'value': value, 'size': size}
+                sheet_memo['size'] += size
+                evict_sheet_memo()
+        return value
+    
+    return wrapper
+
+def clear_sheet_memo(version=None):
+    """Drop every memoized result, keeping the hit and miss counters.
+    Callers hold sheet_memo_lock."""
+    sheet_memo['version'] = version
+    sheet_memo['entries'] = OrderedDict()
+    sheet_memo['size'] = 0
+
+def evict_sheet_memo():
+    """Drop least recently used results until the memo fits its entry and memory caps.
+    Callers hold sheet_memo_lock."""
+    entries = sheet_memo['entries']
+    while entries and (len(entries) > SHEET_MEMO_MAX_ENTRIES or sheet_memo['size'] > SHEET_MEMO_MAX_BYTES):
+        key, entry = entries.popitem(last=False)
+        sheet_memo['size'] -= entry['size']
+        sheet_memo['stats'][key[0]]['evictions'] += 1
+
+def conditional_on_sheet_version(per_upload=False):
+    """Decorator for read views whose response only changes with the sheet version and, if
+    per_upload, the session's upload.
+    
+    Successful responses get a strong ETag of the release, URL, sheet version and upload ID, and
+    a request whose If-None-Match matches it gets a 304 without the view running. Per-upload
+    responses are private to the browser; the rest may also be kept by a shared cache for
+    EDGE_CACHE_MAX_AGE seconds.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            upload_id = ''
+            if per_upload:
+                upload = get_session_upload()
+                if upload is None:
+                    return view(*args, **kwargs)
+                upload_id = upload['id']
+            try:
+                version = get_sheet_snapshot()['version']
+            except Exception:
+                # Let the view report the failure the way it normally does
+                return view(*args, **kwargs)
+            
+            etag = hashlib.sha1(f'{RELEASE_ID}:{request.full_path}:{version}:{upload_id}'.encode('utf-8')).hexdigest()
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
             else:
-                # If a required column is missing in this row, skip the row
-                valid_row = False
-                break
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            
+            response.set_etag(etag)
+            if per_upload:
+                response.headers['Cache-Control'] = 'private, no-cache'
+                response.vary.add('Cookie')
+            else:
+                response.headers['Cache-Control'] = f'public, max-age=0, s-maxage={EDGE_CACHE_MAX_AGE}'
+            return response
+        return wrapper
+    return decorator
+
+# Memoize frequently accessed filter data
+@memoize_per_sheet_version
+def get_origins(snapshot):
+    lane_index = snapshot['lane_index']
+    return sorted(origin for origin in lane_index if origin and origin != '#N/A')
+
+@memoize_per_sheet_version
+def get_destinations_for_origin(snapshot, origin):
+    destinations = snapshot['lane_index'].get(origin, {})
+    return sorted(destination for destination in destinations 
+                  if destination and destination != '#N/A')
+
+@memoize_per_sheet_version
+def get_vehicle_types_for_origin_destination(snapshot, origin, destination):
+    lane = snapshot['lane_index'].get(origin, {}).get(destination)
+    if not lane:
+        return []
+    return sorted(vehicle_type for vehicle_type in lane['vehicle_types'] 
+                  if vehicle_type and vehicle_type != '#N/A')
+
+def ingest_csv_upload(file_stream, progress=None):
+    """Stream an uploaded CSV into per-ODVT rate totals and a lane index for the filter endpoints.
+    
+    The file is decoded and parsed incrementally and only UPLOAD_COLUMNS are kept, in chunks
+    of UPLOAD_CHUNK_ROWS rows, so memory stays bounded regardless of the upload size.
+    progress, if given, is called with the number of rows read after each chunk.
+    """
+    start = time.perf_counter()
+    upload = {
+        'row_count': 0,
+        'rejected_rows': 0,
+        'lanes': {},
+        'rate_totals': {}
+    }
+    
+    text_stream = io.TextIOWrapper(file_stream, encoding='utf-8', newline='')
+    try:
+        csv_reader = csv.reader(text_stream)
+        header = next(csv_reader, [])
+        header_positions = {col_name: i for i, col_name in enumerate(header)}
+        column_positions = [header_positions.get(col_name) for col_name in UPLOAD_COLUMNS]
+        
+        chunk = []
+        for row in csv_reader:
+            # Skip blank lines like csv.DictReader does
+            if not row:
+                continue
+            chunk.append([row[i] if i is not None and i < len(row) else None for i in column_positions])
+            if len(chunk) >= UPLOAD_CHUNK_ROWS:
+                add_upload_chunk(upload, chunk)
+                chunk = []
+                if progress is not None:
+                    progress(upload['row_count'])
+        add_upload_chunk(upload, chunk)
+    finally:
+        # Leave the request's file stream open for Flask to close
+        text_stream.detach()
+    
+    upload['rates'] = build_uploaded_rates(upload.pop('rate_totals'))
+    elapsed = time.perf_counter() - start
+    upload['ingest_stats'] = {
+        'rows': upload['row_count'],
+        'rejected_rows': upload['rejected_rows'],
+        'seconds': elapsed,
+        'rows_per_second': upload['row_count'] / elapsed if elapsed > 0 else 0
+    }
+    with metrics_lock:
+        metrics['uploads']['count'] += 1
+        metrics['uploads']['rows'] += upload['row_count']
+        metrics['uploads']['rejected_rows'] += upload['rejected_rows']
+        metrics['uploads']['seconds'] += elapsed
+        metrics['uploads']['last_rows_per_second'] = upload['ingest_stats']['rows_per_second']
+    return upload
+
+def add_upload_chunk(upload, chunk):
+    """Fold a chunk of projected upload rows into the upload's lane index and rate totals"""
+    if not chunk:
+        return
+    
+    frame = pd.DataFrame.from_records(chunk, columns=UPLOAD_COLUMNS)
+    upload['row_count'] += len(frame)
+    
+    # Index every origin -> destination -> vehicle type combination for the filter endpoints
+    for origin, destination, vehicle_type, listed_vehicle_type in frame[ODVT_COLUMNS + ['Vehicle Type']].drop_duplicates().itertuples(index=False):
+        lane = upload['lanes'].setdefault(origin, {}).setdefault(destination, {
+            'Vehicle Type (New)': set(),
+            'Vehicle Type': set()
+        })
+        lane['Vehicle Type (New)'].add(vehicle_type)
+        lane['Vehicle Type'].add(listed_vehicle_type)
+    
+    # Only rows with a positive shipper rate and a full ODVT count towards the averages
+    frame['Shipper'] = parse_float_column(frame['Shipper'])
+    valid_rows = frame[(frame['Shipper'] > 0) & frame[ODVT_COLUMNS].notna().all(axis=1)]
+    upload['rejected_rows'] += len(frame) - len(valid_rows)
+    
+    grouped = valid_rows.groupby(ODVT_COLUMNS, sort=False)['Shipper'].agg(['count', 'sum'])
+    rate_totals = upload['rate_totals']
+    for lane_key, count, total in zip(grouped.index, grouped['count'].tolist(), grouped['sum'].tolist()):
+        if lane_key in rate_totals:
+            rate_totals[lane_key][0] += count
+            rate_totals[lane_key][1] += total
+        else:
+            rate_totals[lane_key] = [count, total]
+
+def build_uploaded_rates(rate_totals):
+    """Turn per-ODVT [count, sum] totals into a count/sum/mean frame in first-seen order"""
+    lane_keys = list(rate_totals)
+    index = pd.MultiIndex.from_arrays(
+        [[lane_key[i] for lane_key in lane_keys] for i in range(len(ODVT_COLUMNS))],
+        names=ODVT_COLUMNS
+    )
+    rates = pd.DataFrame(list(rate_totals.values()), index=index, columns=['count', 'sum'])
+    rates['count'] = rates['count'].astype(np.int64)
+    rates['sum'] = rates['sum'].astype(np.float64)
+    rates['mean'] = rates['sum'] / rates['count']
+    return rates
+
+def approximate_size(value):
+    """Roughly estimate the memory used by nested dicts, lists, sets and scalars in bytes"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum())
+    
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approximate_size(key) + approximate_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(item) for item in value)
+    return size
+
+def save_upload(upload, fingerprint=None):
+    """Put an upload in the server-side store and return its new upload ID.
+    
+    fingerprint, a (content hash, sheet version) tuple, makes the upload findable with
+    find_cached_upload for as long as it stays in the store.
+    """
+    upload_id = secrets.token_urlsafe(16)
+    upload['id'] = upload_id
+    upload['fingerprint'] = fingerprint
+    upload['size'] = approximate_size(upload)
+    upload['last_access'] = time.time()
+    
+    with upload_store_lock:
+        upload_store[upload_id] = upload
+        if fingerprint is not None:
+            upload_fingerprints[fingerprint] = upload_id
+        evict_uploads()
+    return upload_id
+
+def find_cached_upload(fingerprint):
+    """Get the stored upload analyzed from the same file against the same sheet version, or None"""
+    with upload_store_lock:
+        upload_id = upload_fingerprints.get(fingerprint)
+    upload = get_upload(upload_id) if upload_id else None
+    
+    with metrics_lock:
+        metrics['uploads']['cache_hits' if upload is not None else 'cache_misses'] += 1
+    return upload
+
+def hash_upload_stream(file_stream, copy_to=None):
+    """SHA-256 hex digest of an upload's bytes, read in blocks and optionally copied to copy_to.
+    Without copy_to the stream is rewound so it can be ingested afterwards."""
+    digest = hashlib.sha256()
+    while True:
+        block = file_stream.read(1024 * 1024)
+        if not block:
+            break
+        digest.update(block)
+        if copy_to is not None:
+            copy_to.write(block)
+    if copy_to is None:
+        file_stream.seek(0)
+    return digest.hexdigest()
+
+def get_upload(upload_id):
+    """Get a stored upload by ID, or None if it is unknown or has expired"""
+    with upload_store_lock:
+        evict_uploads()
+        upload = upload_store.get(upload_id)
+        if upload is not None:
+            upload['last_access'] = time.time()
+            upload_store.move_to_end(upload_id)
+        return upload
+
+def evict_uploads():
+    """Drop expired uploads, then least recently used ones until the store fits its memory cap.
+    Callers hold upload_store_lock."""
+    expiry = time.time() - UPLOAD_TTL
+    for upload_id in [upload_id for upload_id, upload in upload_store.items() if upload['last_access'] < expiry]:
+        forget_upload_fingerprint(upload_store.pop(upload_id))
+    
+    total_size = sum(upload['size'] for upload in upload_store.values())
+    while upload_store and total_size > UPLOAD_STORE_MAX_BYTES:
+        _, upload = upload_store.popitem(last=False)
+        forget_upload_fingerprint(upload)
+        total_size -= upload['size']
+
+def forget_upload_fingerprint(upload):
+    """Remove an evicted upload from upload_fingerprints. Callers hold upload_store_lock."""
+    fingerprint = upload.get('fingerprint')
+    if fingerprint is not None and upload_fingerprints.get(fingerprint) == upload['id']:
+        del upload_fingerprints[fingerprint]
+
+def get_upload_origins(upload):
+    """Sorted unique origins of an upload's lanes"""
+    return sorted(origin for origin in upload['lanes'] if origin and origin != '#N/A')
+
+def get_session_upload():
+    """Get the upload referenced by the current session, or None"""
+    upload_id = session.get('upload_id')
+    return get_upload(upload_id) if upload_id else None
+
+def start_analysis_job(path, content_hash=None):
+    """Queue background analysis of an upload spooled to path and return the new job"""
+    job = {
+        'id': secrets.token_urlsafe(16),
+        'status': 'queued',
+        'created': time.time(),
+        'finished': None,
+        'progress': {
+            'rows': 0,
+            'bytes_read': 0,
+            'total_bytes': os.path.getsize(path)
+        },
+        'error': None,
+        'cache_hit': False
+    }
+    with analysis_jobs_lock:
+        evict_analysis_jobs()
+        analysis_jobs[job['id']] = job
+    analysis_job_executor.submit(run_analysis_job, job, path, content_hash)
+    return job
+
+def run_analysis_job(job, path, content_hash=None):
+    """Ingest and analyze a spooled upload for a background job, then delete the file.
+    An upload of the same file against the same sheet version is reused instead."""
+    try:
+        fingerprint = (content_hash, get_sheet_snapshot()['version']) if content_hash else None
+        upload = find_cached_upload(fingerprint) if fingerprint else None
+        if upload is not None:
+            job['cache_hit'] = True
+        else:
+            job['status'] = 'ingesting'
+            with open(path, 'rb') as upload_file:
+                def report_progress(rows):
+                    job['progress']['rows'] = rows
+                    job['progress']['bytes_read'] = upload_file.tell()
+                upload = ingest_csv_upload(upload_file, report_progress)
+            
+            job['status'] = 'analyzing'
+            upload['created'] = time.time()
+            upload['results'] = analyze_rate_data(upload)
+            save_upload(upload, fingerprint)
+        job['progress']['rows'] = upload['row_count']
+        job['progress']['bytes_read'] = job['progress']['total_bytes']
         
-        if valid_row:
-            processed_data.append(row_dict)
-    
-    # Update cache
-    sheet_data_cache['data'] = processed_data
-    sheet_data_cache['timestamp'] = current_time
-    
-    return processed_data
-
-# Use lru_cache for frequently accessed filter data
-@lru_cache(maxsize=128)
-def get_origins():
-    data = get_sheet_data()
-    return sorted(list(set(row.get('Origin cluster name', '') for row in data 
-                          if row.get('Origin cluster name') and row.get('Origin cluster name') != '#N/A')))
-
-@lru_cache(maxsize=128)
-def get_destinations_for_origin(origin):
-    data = get_sheet_data()
-    return sorted(list(set(
-        row.get('Destination cluster name', '') for row in data 
-        if row.get('Origin cluster name') == origin 
-        and row.get('Destination cluster name') 
-        and row.get('Destination cluster name') != '#N/A'
-    )))
-
-@lru_cache(maxsize=128)
-def get_vehicle_types_for_origin_destination(origin, destination):
-    data = get_sheet_data()
-    return sorted(list(set(
-        row.get('Vehicle Type (New)', '') for row in data 
-        if row.get('Origin cluster name') == origin 
-        and row.get('Destination cluster name') == destination 
-        and row.get('Vehicle Type (New)') 
-        and row.get('Vehicle Type (New)') != '#N/A'
-    )))
-
-def parse_csv_file(file_data):
-    """Parse CSV file data into a list of dictionaries"""
-    csv_data = []
-    csv_file = io.StringIO(file_data.decode('utf-8'))
-    csv_reader = csv.DictReader(csv_file)
-    for row in csv_reader:
-        csv_data.append(row)
-    return csv_data
-
-def analyze_rate_data(uploaded_data):
-    """Analyze uploaded rate data compared to benchmark data from Google Sheets"""
-    benchmark_data = get_sheet_data()
+        # The results stay in the upload store only, within its byte cap, and the job is
+        # dropped once its upload is evicted
+        job['upload_id'] = upload['id']
+        job['origins'] = get_upload_origins(upload)
+        job['upload_stats'] = upload['ingest_stats']
+        job['status'] = 'done'
+    except Exception as e:
+        print(f"Error processing file in analysis job: {str(e)}")
+        job['error'] = 'Error processing file'
+        job['status'] = 'failed'
+    finally:
+        job['finished'] = time.time()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def get_analysis_job(job_id):
+    """Get an analysis job by ID, or None if it is unknown or has expired"""
+    with analysis_jobs_lock:
+        evict_analysis_jobs()
+        return analysis_jobs.get(job_id)
+
+def get_analysis_job_upload(job):
+    """Get the stored upload holding a finished job's results, or None if it was evicted"""
+    upload = get_upload(job['upload_id'])
+    if upload is None:
+        with analysis_jobs_lock:
+            analysis_jobs.pop(job['id'], None)
+    return upload
+
+def evict_analysis_jobs():
+    """Drop jobs that finished more than ANALYSIS_JOB_TTL seconds ago, and finished jobs whose
+    upload, which holds their results, was evicted from the upload store. Uploads are evicted
+    least recently used first to keep the store under UPLOAD_STORE_MAX_BYTES, so the results
+    of many jobs never take more memory than that. Callers hold analysis_jobs_lock."""
+    expiry = time.time() - ANALYSIS_JOB_TTL
+    with upload_store_lock:
+        evicted = [
+            job_id for job_id, job in analysis_jobs.items()
+            if job['finished'] and (job['finished'] < expiry or (job['status'] == 'done' and job['upload_id'] not in upload_store))
+        ]
+    for job_id in evicted:
+        del analysis_jobs[job_id]
+
+def get_uploaded_destination_names(upload, origin):
+    """Get the valid destinations uploaded for an origin"""
+    return set(
+        destination for destination in upload['lanes'].get(origin, {}) 
+        if destination and destination != '#N/A'
+    )
+
+def get_uploaded_vehicle_type_names(upload, origin, destination, col_name='Vehicle Type (New)'):
+    """Get the valid values of a vehicle type column uploaded for an origin-destination pair"""
+    lane = upload['lanes'].get(origin, {}).get(destination)
+    if not lane:
+        return set()
+    return set(vehicle_type for vehicle_type in lane[col_name] if vehicle_type and vehicle_type != '#N/A')
+
+def aggregate_benchmark_rates(store, positions=None):
+    """Get per-ODVT count, sum, mean and M2 (sum of squared deviations) of valid benchmark
+    shipper rates, over the given store positions or the whole store"""
+    shipper = store['columns']['Shipper']
+    if positions is None:
+        positions = np.arange(store['size'])
+    valid_positions = positions[shipper[positions] > 0]
+    
+    # Key on the string form of each name, so sheet values match uploaded CSV text
+    key_columns = {}
+    for col_name in ODVT_COLUMNS:
+        names = np.array([str(name) for name in store['categories'][col_name]], dtype=object)
+        key_columns[col_name] = names[store['columns'][col_name][valid_positions]]
+    
+    benchmark_frame = pd.DataFrame(key_columns)
+    benchmark_frame['Shipper'] = shipper[valid_positions]
+    grouped = benchmark_frame.groupby(ODVT_COLUMNS, sort=False)['Shipper']
+    aggregates = grouped.agg(['count', 'sum'])
+    aggregates['mean'] = aggregates['sum'] / aggregates['count']
+    
+    deviations = benchmark_frame['Shipper'] - grouped.transform('mean')
+    aggregates['m2'] = (deviations ** 2).groupby([benchmark_frame[col_name] for col_name in ODVT_COLUMNS], sort=False).sum()
+    return aggregates
+
+def merge_benchmark_aggregates(left, right):
+    """Combine two per-ODVT aggregate tables as if their rows had been aggregated together"""
+    left, right = left.align(right, join='outer', fill_value=0)
+    merged = pd.DataFrame(index=left.index)
+    merged['count'] = (left['count'] + right['count']).astype(np.int64)
+    merged['sum'] = left['sum'] + right['sum']
+    merged['mean'] = merged['sum'] / merged['count']
+    
+    # Chan et al. parallel update of the sum of squared deviations
+    delta = right['mean'] - left['mean']
+    merged['m2'] = left['m2'] + right['m2'] + delta ** 2 * left['count'] * right['count'] / merged['count']
+    return merged
+
+def refresh_benchmark_aggregates(previous_store, previous_aggregates, store):
+    """Get the benchmark aggregates for a newly loaded store, only aggregating appended
+    rows when the new store extends the previous one"""
+    appended_start = get_appended_start(previous_store, store)
+    if appended_start is None or previous_aggregates is None:
+        return aggregate_benchmark_rates(store)
+    if appended_start == store['size']:
+        return previous_aggregates
     
+    appended = aggregate_benchmark_rates(store, np.arange(appended_start, store['size']))
+    return merge_benchmark_aggregates(previous_aggregates, appended)
+
+def get_benchmark_aggregates():
+    """Get the per-ODVT benchmark aggregates for the current sheet version"""
+    return get_sheet_snapshot()['benchmark_aggregates']
+
+def analyze_rate_data(upload):
+    """Compare an upload's per-ODVT average rates with the benchmark's, returning the matched
+    lane differences, overall averages and savings, and insights"""
     # Analyze the data
     analysis_results = {
         'avg_uploaded_shipper': 0,
@@ -215,113 +1664,60 @@ def analyze_rate_data(uploaded_data):
         'insights': []
     }
     
-    # Initialize totals for average calculations
-    total_uploaded = 0
-    total_benchmark = 0
+    # Average both sides per ODVT and join them, keeping the uploaded lane order
+    uploaded_lookup = upload['rates']
+    benchmark_lookup = get_benchmark_aggregates()
+    matched = uploaded_lookup.join(benchmark_lookup, how='inner', lsuffix='_uploaded', rsuffix='_benchmark')
     
-    # Create lookup dictionaries and process data
-    uploaded_lookup = {}
-    for row in uploaded_data:
-        lookup_key = f"{row.get('Origin cluster name')}|{row.get('Destination cluster name')}|{row.get('Vehicle Type (New)')}"
-        
-        # Convert shipper rate to numeric
-        try:
-            shipper_rate = float(row.get('Shipper', 0))
-        except (ValueError, TypeError):
-            shipper_rate = 0
-            
-        # Calculate running average for uploaded rates per ODVT
-        if shipper_rate > 0:
-            if lookup_key in uploaded_lookup:
-                existing_count = uploaded_lookup[lookup_key]['count']
-                existing_avg = uploaded_lookup[lookup_key]['Shipper']
-                new_avg = (existing_avg * existing_count + shipper_rate) / (existing_count + 1)
-                uploaded_lookup[lookup_key]['Shipper'] = new_avg
-                uploaded_lookup[lookup_key]['count'] = existing_count + 1
-            else:
-                uploaded_lookup[lookup_key] = {
-                    'Shipper': shipper_rate,
-                    'count': 1,
-                    'Origin cluster name': row.get('Origin cluster name'),
-                    'Destination cluster name': row.get('Destination cluster name'),
-                    'Vehicle Type (New)': row.get('Vehicle Type (New)')
-                }
-    
-    # Create a benchmark lookup dictionary with averages
-    benchmark_lookup = {}
-    for row in benchmark_data:
-        lookup_key = f"{row.get('Origin cluster name')}|{row.get('Destination cluster name')}|{row.get('Vehicle Type (New)')}"
-        
-        # Convert shipper rate to numeric
-        try:
-            shipper_rate = float(row.get('Shipper', 0))
-        except (ValueError, TypeError):
-            shipper_rate = 0
-            continue  # Skip this row entirely if rate conversion fails
-            
-        # Only add to lookup if we have a valid shipper rate
-        if shipper_rate > 0:
-            if lookup_key in benchmark_lookup:
-                existing_count = benchmark_lookup[lookup_key]['count']
-                existing_avg = benchmark_lookup[lookup_key]['Shipper']
-                new_avg = (existing_avg * existing_count + shipper_rate) / (existing_count + 1)
-                benchmark_lookup[lookup_key]['Shipper'] = new_avg
-                benchmark_lookup[lookup_key]['count'] = existing_count + 1
-            else:
-                benchmark_lookup[lookup_key] = {
-                    'Shipper': shipper_rate,
-                    'count': 1,
-                    'Origin cluster name': row.get('Origin cluster name'),
-                    'Destination cluster name': row.get('Destination cluster name'),
-                    'Vehicle Type (New)': row.get('Vehicle Type (New)')
-                }
-    
-    # Compare averages for each ODVT
-    for lookup_key, uploaded_data in uploaded_lookup.items():
-        if lookup_key in benchmark_lookup:
-            uploaded_avg = uploaded_data['Shipper']
-            benchmark_avg = benchmark_lookup[lookup_key]['Shipper']
-            
-            if uploaded_avg > 0 and benchmark_avg > 0:
-                total_uploaded += uploaded_avg
-                total_benchmark += benchmark_avg
-                analysis_results['total_matches'] += 1
-                
-                # Calculate difference between averages
-                diff_amount = uploaded_avg - benchmark_avg
-                diff_percent = (diff_amount / uploaded_avg * 100) if uploaded_avg > 0 else 0
-                
-                # Create lane difference object
-                lane_diff = {
-                    'origin': uploaded_data['Origin cluster name'],
-                    'destination': uploaded_data['Destination cluster name'],
-                    'vehicle_type': uploaded_data['Vehicle Type (New)'],
-                    'uploaded_rate': uploaded_avg,
-                    'benchmark_rate': benchmark_avg,
-                    'difference': diff_amount,
-                    'difference_percent': diff_percent,
-                    'uploaded_count': uploaded_data['count'],
-                    'benchmark_count': benchmark_lookup[lookup_key]['count']
-                }
-                
-                # Store in all lane differences
-                analysis_results['all_lane_differences'].append(lane_diff)
-                # Also store in lane_differences for top 5 display
-                analysis_results['lane_differences'].append(lane_diff.copy())
+    # Calculate difference between averages
+    uploaded_avg = matched['mean_uploaded'].to_numpy()
+    benchmark_avg = matched['mean_benchmark'].to_numpy()
+    diff_amount = uploaded_avg - benchmark_avg
+    diff_percent = diff_amount / uploaded_avg * 100
+    
+    analysis_results['total_matches'] = len(matched)
+    total_uploaded = uploaded_avg.sum()
+    total_benchmark = benchmark_avg.sum()
+    
+    # Create lane difference objects
+    analysis_results['all_lane_differences'] = [
+        {
+            'origin': origin,
+            'destination': destination,
+            'vehicle_type': vehicle_type,
+            'uploaded_rate': uploaded_rate,
+            'benchmark_rate': benchmark_rate,
+            'difference': difference,
+            'difference_percent': difference_percent,
+            'uploaded_count': uploaded_count,
+            'benchmark_count': benchmark_count
+        }
+        for (origin, destination, vehicle_type), uploaded_rate, benchmark_rate, difference, difference_percent, uploaded_count, benchmark_count
+        in zip(
+            matched.index,
+            uploaded_avg.tolist(),
+            benchmark_avg.tolist(),
+            diff_amount.tolist(),
+            diff_percent.tolist(),
+            matched['count_uploaded'].tolist(),
+            matched['count_benchmark'].tolist()
+        )
+    ]
     
     # Calculate average rates
     if analysis_results['total_matches'] > 0:
-        analysis_results['avg_uploaded_shipper'] = total_uploaded / analysis_results['total_matches']
-        analysis_results['avg_benchmark_shipper'] = total_benchmark / analysis_results['total_matches']
+        analysis_results['avg_uploaded_shipper'] = float(total_uploaded) / analysis_results['total_matches']
+        analysis_results['avg_benchmark_shipper'] = float(total_benchmark) / analysis_results['total_matches']
     
     # Calculate total savings based on averages
     if analysis_results['avg_uploaded_shipper'] > 0:
         analysis_results['savings_amount'] = analysis_results['avg_uploaded_shipper'] - analysis_results['avg_benchmark_shipper']
         analysis_results['savings_percent'] = (analysis_results['savings_amount'] / analysis_results['avg_uploaded_shipper'] * 100)
     
-    # Sort and keep top 5 for display, but keep all differences in all_lane_differences
-    analysis_results['lane_differences'].sort(key=lambda x: abs(x['difference']), reverse=True)
-    analysis_results['lane_differences'] = analysis_results['lane_differences'][:5]
+    # Keep the top 5 by absolute difference for display, without sorting every lane
+    analysis_results['lane_differences'] = heapq.nlargest(
+        5, analysis_results['all_lane_differences'], key=lambda x: abs(x['difference'])
+    )
     
     # Generate insights
     # 1. Overall savings insight
@@ -337,10 +1733,10 @@ def analyze_rate_data(uploaded_data):
         })
     
     # 2. Match rate insight
-    match_percent = (analysis_results['total_matches'] / len(uploaded_data) * 100) if len(uploaded_data) > 0 else 0
+    match_percent = (analysis_results['total_matches'] / upload['row_count'] * 100) if upload['row_count'] > 0 else 0
     analysis_results['insights'].append({
         'type': 'neutral',
-        'message': f"Analysis matched {analysis_results['total_matches']} out of {len(uploaded_data)} uploaded lanes ({match_percent:.2f}%)."
+        'message': f"Analysis matched {analysis_results['total_matches']} out of {upload['row_count']} uploaded lanes ({match_percent:.2f}%)."
     })
     
     # 3. Top savings lanes insight
@@ -373,23 +1769,20 @@ def analyze_rate_data(uploaded_data):
     return analysis_results
 
 @app.route('/')
+@conditional_on_sheet_version()
 def index():
     origins = get_origins()
     return render_template('index.html', origins=origins)
 
 @app.route('/get_destinations/<origin>')
+@conditional_on_sheet_version(per_upload=True)
 def get_destinations(origin):
-    if 'uploaded_data' not in session:
+    upload = get_session_upload()
+    if upload is None:
         return jsonify({'error': 'No uploaded data found'}), 400
 
     # Get destinations from uploaded data for this origin
-    uploaded_destinations = set(
-        row['Destination cluster name'] 
-        for row in session['uploaded_data'] 
-        if row['Origin cluster name'] == origin 
-        and row['Destination cluster name'] 
-        and row['Destination cluster name'] != '#N/A'
-    )
+    uploaded_destinations = get_uploaded_destination_names(upload, origin)
 
     # Get destinations from Google Sheets for this origin
     google_sheet_destinations = get_destinations_for_origin(origin)
@@ -400,19 +1793,14 @@ def get_destinations(origin):
     return jsonify(common_destinations)
 
 @app.route('/get_vehicle_types/<origin>/<destination>')
+@conditional_on_sheet_version(per_upload=True)
 def get_vehicle_types(origin, destination):
-    if 'uploaded_data' not in session:
+    upload = get_session_upload()
+    if upload is None:
         return jsonify({'error': 'No uploaded data found'}), 400
 
     # Get vehicle types from uploaded data for this origin-destination pair
-    uploaded_vehicle_types = set(
-        row['Vehicle Type (New)']  # Using the correct column name from your CSV
-        for row in session['uploaded_data'] 
-        if row['Origin cluster name'] == origin 
-        and row['Destination cluster name'] == destination
-        and row['Vehicle Type (New)'] 
-        and row['Vehicle Type (New)'] != '#N/A'
-    )
+    uploaded_vehicle_types = get_uploaded_vehicle_type_names(upload, origin, destination)
 
     # Get vehicle types from Google Sheets for this origin-destination pair
     google_sheet_vehicle_types = get_vehicle_types_for_origin_destination(origin, destination)
@@ -431,57 +1819,341 @@ def analyze_rates():
     if not file.filename.endswith('.csv'):
         return jsonify({'error': 'Please upload a CSV file'}), 400
     
+    if request.args.get('async') == '1' or request.form.get('async') == '1':
+        path = None
+        try:
+            # Spool the file to disk so the job can outlive this request
+            fd, path = tempfile.mkstemp(prefix='upload-', suffix='.csv')
+            with os.fdopen(fd, 'wb') as spool_file:
+                content_hash = hash_upload_stream(file.stream, copy_to=spool_file)
+            job = start_analysis_job(path, content_hash)
+        except Exception as e:
+            print(f"Error starting analysis job: {str(e)}")
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+            return jsonify({'error': 'Error processing file'}), 500
+        return jsonify({'job_id': job['id'], 'status': job['status']}), 202
+    
     try:
-        file_data = file.read()
-        uploaded_data = parse_csv_file(file_data)
-        
-        # Store uploaded data in session for filter endpoints
-        session['uploaded_data'] = uploaded_data
-        
-        results = analyze_rate_data(uploaded_data)
-        
-        # Get unique origins from uploaded data
-        origins = sorted(list(set(row.get('Origin cluster name', '') for row in uploaded_data 
-                              if row.get('Origin cluster name') and row.get('Origin cluster name') != '#N/A')))
+        # The same file analyzed against the same sheet version gives the same results, so reuse them
+        fingerprint = (hash_upload_stream(file.stream), get_sheet_snapshot()['version'])
+        upload = find_cached_upload(fingerprint)
+        cache_hit = upload is not None
+        if not cache_hit:
+            upload = ingest_csv_upload(file.stream)
+            
+            # Keep the indexed upload and its results server-side for the filter and lane difference
+            # endpoints, referenced from the session
+            upload['created'] = time.time()
+            upload['results'] = analyze_rate_data(upload)
+            save_upload(upload, fingerprint)
+        session['upload_id'] = upload['id']
         
         return jsonify({
-            'results': results,
-            'origins': origins
+            'results': summarize_analysis_results(upload['results']),
+            'origins': get_upload_origins(upload),
+            'upload_stats': upload['ingest_stats'],
+            'cache_hit': cache_hit
         })
     except Exception as e:
         print(f"Error processing file: {str(e)}")
         return jsonify({'error': 'Error processing file'}), 500
 
+@app.route('/analysis_jobs/<job_id>')
+def get_analysis_job_status(job_id):
+    """Progress of a background analysis job, and its results without the full lane list once done"""
+    job = get_analysis_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    
+    progress = job['progress']
+    response = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'progress': dict(progress, percent=progress['bytes_read'] / progress['total_bytes'] * 100 if progress['total_bytes'] else 100),
+        'error': job['error'],
+        'cache_hit': job['cache_hit']
+    }
+    if job['status'] == 'done':
+        upload = get_analysis_job_upload(job)
+        if upload is None:
+            return jsonify({'error': 'Unknown or expired job'}), 404
+        # Point the filter endpoints at the analyzed upload, as the synchronous mode does
+        session['upload_id'] = job['upload_id']
+        response['results'] = summarize_analysis_results(upload['results'])
+        response['origins'] = job['origins']
+        response['upload_stats'] = job['upload_stats']
+    return jsonify(response)
+
+@app.route('/analysis_jobs/<job_id>/results')
+def get_analysis_job_results(job_id):
+    """A page of a finished job's lane differences, see select_lane_differences"""
+    job = get_analysis_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if job['status'] != 'done':
+        return jsonify({'error': f"Job is {job['status']}"}), 409
+    upload = get_analysis_job_upload(job)
+    if upload is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    
+    return lane_differences_page(upload['results']['all_lane_differences'])
+
+@app.route('/lane_differences')
+@conditional_on_sheet_version(per_upload=True)
+def get_lane_differences():
+    """A page of the lane differences for the session's upload, see select_lane_differences"""
+    upload = get_session_upload()
+    if upload is None or 'results' not in upload:
+        return jsonify({'error': 'No uploaded data found'}), 400
+    
+    return lane_differences_page(upload['results']['all_lane_differences'])
+
+@app.route('/lane_tree')
+@conditional_on_sheet_version(per_upload=True)
+def get_lane_tree():
+    """Every origin -> destination -> vehicle type choice the filter dropdowns offer for the
+    session's upload, so the page can cascade them without a request per selection"""
+    upload = get_session_upload()
+    if upload is None:
+        return jsonify({'error': 'No uploaded data found'}), 400
+    
+    return jsonify(get_upload_lane_tree(upload, get_sheet_snapshot()['version']))
+
+def get_upload_lane_tree(upload, version):
+    """The upload's lane tree for a sheet version, built once and kept with the upload as
+    (version, tree, size), counted in the upload's size towards UPLOAD_STORE_MAX_BYTES"""
+    cached = upload.get('lane_tree')
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    
+    lane_tree = build_lane_tree(upload)
+    size = approximate_size(lane_tree)
+    with upload_store_lock:
+        previous = upload.get('lane_tree')
+        upload['size'] += size - (previous[2] if previous is not None else 0)
+        upload['lane_tree'] = (version, lane_tree, size)
+        evict_uploads()
+    return lane_tree
+
+def build_lane_tree(upload):
+    """Intersect the uploaded and benchmark lanes into a dictionary-encoded tree.
+    
+    Matches /get_destinations and /get_vehicle_types for every upload origin. Names are listed
+    once in 'names' and referenced by index, and the tree is a list of
+    [origin, [[destination, [vehicle type, ...]], ...]] entries in dropdown order. Origins
+    without a common destination are left out.
+    """
+    names = []
+    name_codes = {}
+    
+    def encode(name):
+        code = name_codes.get(name)
+        if code is None:
+            code = name_codes[name] = len(names)
+            names.append(name)
+        return code
+    
+    tree = []
+    for origin in get_upload_origins(upload):
+        destinations = sorted(get_uploaded_destination_names(upload, origin).intersection(get_destinations_for_origin(origin)))
+        if not destinations:
+            continue
+        
+        branches = []
+        for destination in destinations:
+            vehicle_types = sorted(get_uploaded_vehicle_type_names(upload, origin, destination).intersection(
+                get_vehicle_types_for_origin_destination(origin, destination)))
+            branches.append([encode(destination), [encode(vehicle_type) for vehicle_type in vehicle_types]])
+        tree.append([encode(origin), branches])
+    
+    return {'names': names, 'tree': tree}
+
+def summarize_analysis_results(results):
+    """Get analysis results without the full lane list, which is served a page at a time"""
+    summary = {key: value for key, value in results.items() if key != 'all_lane_differences'}
+    summary['lane_count'] = len(results['all_lane_differences'])
+    return summary
+
+def lane_differences_page(lane_differences):
+    """Respond with the page of lane_differences selected by the request's query parameters"""
+    try:
+        filters, sort, order = parse_lane_differences_query()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', ANALYSIS_RESULTS_PAGE_SIZE, type=int)
+    if offset < 0 or limit < 1 or limit > ANALYSIS_RESULTS_MAX_PAGE_SIZE:
+        return jsonify({'error': f'offset must be >= 0 and limit between 1 and {ANALYSIS_RESULTS_MAX_PAGE_SIZE}'}), 400
+    
+    page, total = select_lane_differences(lane_differences, filters, sort, order == 'desc', offset, limit)
+    return jsonify({
+        'lane_differences': page,
+        'offset': offset,
+        'limit': limit,
+        'total': total,
+        'sort': sort,
+        'order': order
+    })
+
+def parse_lane_differences_query():
+    """Get the (filters, sort, order) query parameters for lane differences, or raise ValueError"""
+    sort = request.args.get('sort', 'abs_difference')
+    order = request.args.get('order', 'desc')
+    if sort not in LANE_DIFFERENCE_SORT_KEYS:
+        raise ValueError(f"sort must be one of {', '.join(LANE_DIFFERENCE_SORT_KEYS)}")
+    if order not in ('asc', 'desc'):
+        raise ValueError('order must be asc or desc')
+    
+    filters = {
+        field: request.args[field]
+        for field in ('origin', 'destination', 'vehicle_type')
+        if request.args.get(field)
+    }
+    return filters, sort, order
+
+def select_lane_differences(lane_differences, filters, sort, descending, offset, limit):
+    """Get one page of the lane differences matching filters, sorted by a LANE_DIFFERENCE_SORT_KEYS
+    key, and the number of matching lanes.
+    
+    Only the first offset + limit lanes are ordered, with a heap, unless that is most of them.
+    Ties keep the analysis order.
+    """
+    if filters:
+        lane_differences = [
+            lane for lane in lane_differences
+            if all(lane[field] == value for field, value in filters.items())
+        ]
+    
+    key = LANE_DIFFERENCE_SORT_KEYS[sort]
+    count = offset + limit
+    if count < len(lane_differences) // 2:
+        selected = (heapq.nlargest if descending else heapq.nsmallest)(count, lane_differences, key=key)
+    else:
+        selected = sorted(lane_differences, key=key, reverse=descending)
+    return selected[offset:count], len(lane_differences)
+
+@app.route('/export_lane_differences')
+def export_session_lane_differences():
+    """Download every lane difference of the session's upload, see export_lane_differences"""
+    upload = get_session_upload()
+    if upload is None or 'results' not in upload:
+        return jsonify({'error': 'No uploaded data found'}), 400
+    
+    return export_lane_differences(upload['results']['all_lane_differences'])
+
+@app.route('/analysis_jobs/<job_id>/export')
+def export_analysis_job(job_id):
+    """Download every lane difference of a finished job, see export_lane_differences"""
+    job = get_analysis_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if job['status'] != 'done':
+        return jsonify({'error': f"Job is {job['status']}"}), 409
+    upload = get_analysis_job_upload(job)
+    if upload is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    
+    return export_lane_differences(upload['results']['all_lane_differences'])
+
+def export_lane_differences(lane_differences):
+    """Stream lane differences as a CSV or, with format=xlsx, XLSX download.
+    
+    Takes the sort, order and filter parameters of lane_differences_page. Rows are written a
+    batch at a time as the response is sent, so the file is never held in memory whole.
+    """
+    try:
+        filters, sort, order = parse_lane_differences_query()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'xlsx'):
+        return jsonify({'error': 'format must be csv or xlsx'}), 400
+    if export_format == 'xlsx' and xlsxwriter is None:
+        return jsonify({'error': 'XLSX export needs the xlsxwriter package'}), 501
+    
+    # Order references to the stored lanes, the rows themselves are only formatted while streaming
+    lanes, _ = select_lane_differences(lane_differences, filters, sort, order == 'desc', 0, len(lane_differences))
+    
+    if export_format == 'xlsx':
+        body = generate_lane_differences_xlsx(lanes)
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    else:
+        body = generate_lane_differences_csv(lanes)
+        mimetype = 'text/csv'
+    response = Response(body, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=lane-differences.{export_format}'
+    return response
+
+def generate_lane_differences_csv(lanes):
+    """Yield a CSV of lanes EXPORT_BATCH_ROWS rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([heading for _, heading in LANE_DIFFERENCE_EXPORT_COLUMNS])
+    fields = [field for field, _ in LANE_DIFFERENCE_EXPORT_COLUMNS]
+    
+    for start in range(0, len(lanes), EXPORT_BATCH_ROWS):
+        writer.writerows([lane[field] for field in fields] for lane in lanes[start:start + EXPORT_BATCH_ROWS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # No lanes, only the header
+        yield buffer.getvalue()
+
+def generate_lane_differences_xlsx(lanes):
+    """Write lanes to a temporary XLSX file in xlsxwriter's constant memory mode, then yield the
+    file in EXPORT_READ_BYTES chunks and delete it"""
+    fd, path = tempfile.mkstemp(prefix='lane-differences-', suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True})
+        worksheet = workbook.add_worksheet('Lane Differences')
+        bold = workbook.add_format({'bold': True})
+        number = workbook.add_format({'num_format': '#,##0.00'})
+        fields = [field for field, _ in LANE_DIFFERENCE_EXPORT_COLUMNS]
+        
+        worksheet.write_row(0, 0, [heading for _, heading in LANE_DIFFERENCE_EXPORT_COLUMNS], bold)
+        for row, lane in enumerate(lanes, start=1):
+            for col, field in enumerate(fields):
+                value = lane[field]
+                if isinstance(value, float):
+                    worksheet.write_number(row, col, value, number)
+                else:
+                    worksheet.write(row, col, value)
+        workbook.close()
+        
+        with open(path, 'rb') as export_file:
+            while True:
+                block = export_file.read(EXPORT_READ_BYTES)
+                if not block:
+                    break
+                yield block
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
 @app.route('/get_uploaded_destinations/<origin>')
+@conditional_on_sheet_version(per_upload=True)
 def get_uploaded_destinations(origin):
-    if 'uploaded_data' not in session:
+    upload = get_session_upload()
+    if upload is None:
         return jsonify({'error': 'No uploaded data found'}), 400
     
-    uploaded_data = session['uploaded_data']
-    destinations = sorted(list(set(
-        row.get('Destination cluster name', '') 
-        for row in uploaded_data 
-        if row.get('Origin cluster name') == origin 
-        and row.get('Destination cluster name') 
-        and row.get('Destination cluster name') != '#N/A'
-    )))
+    destinations = sorted(get_uploaded_destination_names(upload, origin))
     
     return jsonify(destinations)
 
 @app.route('/get_uploaded_vehicle_types/<origin>/<destination>')
+@conditional_on_sheet_version(per_upload=True)
 def get_uploaded_vehicle_types(origin, destination):
-    if 'uploaded_data' not in session:
+    upload = get_session_upload()
+    if upload is None:
         return jsonify({'error': 'No uploaded data found'}), 400
     
-    uploaded_data = session['uploaded_data']
-    vehicle_types = sorted(list(set(
-        row.get('Vehicle Type', '') 
-        for row in uploaded_data 
-        if row.get('Origin cluster name') == origin 
-        and row.get('Destination cluster name') == destination
-        and row.get('Vehicle Type') 
-        and row.get('Vehicle Type') != '#N/A'
-    )))
+    vehicle_types = sorted(get_uploaded_vehicle_type_names(upload, origin, destination, 'Vehicle Type'))
     
     return jsonify(vehicle_types)
 
@@ -498,76 +2170,250 @@ def download_sample():
 
 @app.route('/clear_cache')
 def clear_cache():
-    """Admin endpoint to clear the cache if needed"""
-    get_origins.cache_clear()
-    get_destinations_for_origin.cache_clear()
-    get_vehicle_types_for_origin_destination.cache_clear()
-    sheet_data_cache['data'] = None
-    sheet_data_cache['timestamp'] = 0
-    return jsonify({"status": "Cache cleared successfully"})
-
-def get_transporters_for_lane(origin, destination):
-    """Get top 5 transporters with their ratings and metrics for a specific lane"""
-    data = get_sheet_data()
-    
-    # Filter data for the specific lane
-    lane_data = [
-        row for row in data 
-        if row.get('Origin cluster name') == origin 
-        and row.get('Destination cluster name') == destination
-        and row.get('Transporter')
-    ]
+    """Admin endpoint to clear the cache if needed.
     
-    # Create transporter summary
-    transporter_summary = {}
-    for row in lane_data:
-        transporter = row['Transporter']
+    With shared snapshots the sheet is refetched and published right away, so every process
+    on the host switches to it; clearing only this process's copy would reload the same one.
+    """
+    with sheet_memo_lock:
+        clear_sheet_memo()
+    if SHEET_SNAPSHOT_SHARING == 'shared' and SNAPSHOT_DIR:
         try:
-            rate = float(row['Shipper'])
-            if rate <= 0:  # Skip invalid rates
-                continue
-            
-            # Handle rating - could be empty or invalid
-            rating = None
-            try:
-                if row.get('Rating'):
-                    rating = float(row['Rating'])
-                    if rating <= 0:  # Skip invalid ratings but keep the row
-                        rating = None
-            except (ValueError, TypeError):
-                rating = None
-                
-        except (ValueError, TypeError):
-            continue
-            
-        if transporter in transporter_summary:
-            existing = transporter_summary[transporter]
-            if rating is not None:
-                existing['total_rating'] += rating
-                existing['valid_ratings'] += 1
-                existing['avg_rating'] = existing['total_rating'] / existing['valid_ratings']
-            existing['total_rate'] += rate
-            existing['trip_count'] += 1
-            existing['avg_rate'] = existing['total_rate'] / existing['trip_count']
-        else:
-            summary = {
-                'name': transporter,
-                'total_rate': rate,
-                'trip_count': 1,
-                'avg_rate': rate,
-                'total_rating': rating if rating is not None else 0,
-                'valid_ratings': 1 if rating is not None else 0,
-                'avg_rating': rating if rating is not None else None
-            }
-            transporter_summary[transporter] = summary
+            with sheet_refresh_lock:
+                refresh_shared_snapshot(blocking=True, force=True)
+        except Exception as e:
+            print(f"Error refreshing shared sheet snapshot: {str(e)}")
+            return jsonify({'error': 'Error refreshing sheet data'}), 500
+        return jsonify({"status": "Cache cleared successfully", "scope": "shared"})
     
-    # Convert to list and sort by average rating (if available) then by trip count
-    transporters = list(transporter_summary.values())
-    transporters.sort(key=lambda x: (x['avg_rating'] if x['avg_rating'] is not None else -1, x['trip_count']), reverse=True)
+    sheet_data_cache['snapshot'] = None
+    return jsonify({"status": "Cache cleared successfully", "scope": "process"})
+
+@app.route('/cache_status')
+def cache_status():
+    """Admin endpoint reporting the age and refresh timings of the sheet snapshot"""
+    snapshot = sheet_data_cache['snapshot']
+    return jsonify({
+        'refresh_mode': SHEET_REFRESH_MODE,
+        'snapshot_sharing': SHEET_SNAPSHOT_SHARING,
+        'source': snapshot['source'] if snapshot else None,
+        'version': snapshot['version'] if snapshot else None,
+        'rows': snapshot['data']['size'] if snapshot else 0,
+        'snapshot_age_seconds': time.time() - snapshot['timestamp'] if snapshot else None,
+        'refreshing': sheet_data_cache['refreshing'],
+        'last_refresh_duration_seconds': sheet_data_cache['last_refresh_duration'],
+        'last_refresh_error': sheet_data_cache['last_refresh_error'],
+        'last_fetch': {
+            key: snapshot['fetch_state'][key]
+            for key in ('kind', 'sheet_rows', 'rows_fetched', 'request_seconds', 'response_bytes', 'parse_seconds')
+        } if snapshot and 'fetch_state' in snapshot else None,
+        'sheets_client': sheets_client['stats'],
+        'memo': {
+            'version': sheet_memo['version'],
+            'entries': len(sheet_memo['entries']),
+            'bytes': sheet_memo['size'],
+            'stats': sheet_memo['stats']
+        }
+    })
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus text exposition of request latency, Sheets API, cache and upload metrics"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/profiles')
+def list_profiles():
+    """Captured request profiles, newest first, without their data"""
+    with profile_store_lock:
+        profiles = [
+            {key: value for key, value in profile.items() if key != 'data'}
+            for profile in reversed(profile_store.values())
+        ]
+    return jsonify({
+        'profiling': PROFILING,
+        'sample_rate': PROFILE_SAMPLE_RATE,
+        'slow_threshold_seconds': PROFILE_SLOW_THRESHOLD,
+        'header': PROFILE_HEADER,
+        'profiles': profiles
+    })
+
+@app.route('/profiles/<profile_id>')
+def download_profile(profile_id):
+    """Download a profile: pstats data for cProfile profiles, collapsed stacks for sampled ones"""
+    with profile_store_lock:
+        profile = profile_store.get(profile_id)
+    if profile is None:
+        return jsonify({'error': 'Unknown or expired profile'}), 404
+    
+    if profile['kind'] == 'cprofile':
+        mimetype, extension = 'application/octet-stream', 'prof'
+    else:
+        mimetype, extension = 'text/plain', 'folded'
+    return send_file(io.BytesIO(profile['data']),
+                     mimetype=mimetype,
+                     as_attachment=True,
+                     download_name=f'profile-{profile_id}.{extension}')
+
+def escape_label_value(value):
+    """Escape backslashes, double quotes and newlines in a Prometheus label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    """Format a label dict as a Prometheus label set, like {route="/",method="GET"}"""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in labels.items()) + '}'
+
+def render_histogram(lines, name, labels, histogram):
+    """Append a histogram's cumulative bucket, sum and count samples to lines"""
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), histogram['buckets']):
+        cumulative += count
+        lines.append(f'{name}_bucket{format_labels(dict(labels, le=bound))} {cumulative}')
+    lines.append(f'{name}_sum{format_labels(labels)} {histogram["sum"]}')
+    lines.append(f'{name}_count{format_labels(labels)} {histogram["count"]}')
+
+def render_metrics():
+    """Render all metrics in the Prometheus text format"""
+    lines = []
+    
+    def add_metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            lines.append(f'{name}{format_labels(labels)} {value}')
     
-    # Get top 5 transporters and add tier
-    top_transporters = transporters[:5]
-    for t in top_transporters:
+    # Copy the counters under the lock, then format without holding it
+    with metrics_lock:
+        routes = {key: dict(histogram, buckets=list(histogram['buckets'])) for key, histogram in metrics['routes'].items()}
+        sheets_api = dict(metrics['sheets_api'], buckets=list(metrics['sheets_api']['buckets']))
+        uploads = dict(metrics['uploads'])
+        sheet_cache = dict(sheet_data_cache['stats'])
+    with sheet_memo_lock:
+        memo_stats = {name: dict(stats) for name, stats in sheet_memo['stats'].items()}
+        memo_entries = len(sheet_memo['entries'])
+        memo_bytes = sheet_memo['size']
+    with upload_store_lock:
+        upload_entries = len(upload_store)
+        upload_bytes = sum(upload['size'] for upload in upload_store.values())
+    with analysis_jobs_lock:
+        job_statuses = {}
+        for job in analysis_jobs.values():
+            job_statuses[job['status']] = job_statuses.get(job['status'], 0) + 1
+    
+    lines.append('# HELP prebid_request_duration_seconds Request latency by route, method and status')
+    lines.append('# TYPE prebid_request_duration_seconds histogram')
+    for (route, method, status), histogram in sorted(routes.items()):
+        render_histogram(lines, 'prebid_request_duration_seconds', {'route': route, 'method': method, 'status': status}, histogram)
+    
+    lines.append('# HELP prebid_sheets_api_duration_seconds Google Sheets API call latency')
+    lines.append('# TYPE prebid_sheets_api_duration_seconds histogram')
+    render_histogram(lines, 'prebid_sheets_api_duration_seconds', {}, sheets_api)
+    
+    stats = sheets_client['stats']
+    add_metric('prebid_sheets_api_calls_total', 'counter', 'Google Sheets API calls', [({}, stats['api_calls'])])
+    add_metric('prebid_sheets_api_errors_total', 'counter', 'Failed Google Sheets API calls', [({}, stats['api_errors'])])
+    add_metric('prebid_sheets_api_response_bytes_total', 'counter', 'Google Sheets API response body bytes', [({}, stats['response_bytes'])])
+    add_metric('prebid_sheets_token_refreshes_total', 'counter', 'Google Sheets access token refreshes', [({}, stats['token_refreshes'])])
+    
+    add_metric('prebid_sheet_cache_lookups_total', 'counter', 'Sheet snapshot lookups by outcome', [
+        ({'outcome': outcome}, sheet_cache[outcome]) for outcome in ('hits', 'stale_hits', 'misses')
+    ])
+    add_metric('prebid_sheet_refreshes_total', 'counter', 'Sheet snapshot refreshes by result', [
+        ({'result': 'ok'}, sheet_cache['refreshes']), ({'result': 'error'}, sheet_cache['refresh_errors'])
+    ])
+    
+    snapshot = sheet_data_cache['snapshot']
+    add_metric('prebid_sheet_snapshot_age_seconds', 'gauge', 'Seconds since the current sheet snapshot was fetched', [
+        ({}, time.time() - snapshot['timestamp'] if snapshot else 'NaN')
+    ])
+    add_metric('prebid_sheet_snapshot_rows', 'gauge', 'Rows in the current sheet snapshot', [
+        ({}, snapshot['data']['size'] if snapshot else 0)
+    ])
+    add_metric('prebid_sheet_last_refresh_duration_seconds', 'gauge', 'Duration of the last sheet refresh', [
+        ({}, sheet_data_cache['last_refresh_duration'] if sheet_data_cache['last_refresh_duration'] is not None else 'NaN')
+    ])
+    
+    for outcome in ('hits', 'misses', 'evictions'):
+        add_metric(f'prebid_memo_{outcome}_total', 'counter', f'Sheet-derived memo {outcome} by function', [
+            ({'function': name}, function_stats[outcome]) for name, function_stats in sorted(memo_stats.items())
+        ])
+    add_metric('prebid_memo_entries', 'gauge', 'Entries in the sheet-derived memo', [({}, memo_entries)])
+    add_metric('prebid_memo_bytes', 'gauge', 'Approximate bytes held by the sheet-derived memo', [({}, memo_bytes)])
+    
+    add_metric('prebid_upload_files_total', 'counter', 'Uploaded CSV files ingested', [({}, uploads['count'])])
+    add_metric('prebid_upload_rows_total', 'counter', 'Uploaded CSV rows ingested', [({}, uploads['rows'])])
+    add_metric('prebid_upload_rejected_rows_total', 'counter', 'Uploaded CSV rows without a valid rate or lane', [({}, uploads['rejected_rows'])])
+    add_metric('prebid_upload_ingest_seconds_total', 'counter', 'Time spent ingesting uploaded CSVs', [({}, uploads['seconds'])])
+    add_metric('prebid_upload_last_rows_per_second', 'gauge', 'Ingest throughput of the last uploaded CSV', [({}, uploads['last_rows_per_second'])])
+    add_metric('prebid_upload_cache_lookups_total', 'counter', 'Uploads looked up by content hash and sheet version, by outcome', [
+        ({'outcome': 'hit'}, uploads['cache_hits']), ({'outcome': 'miss'}, uploads['cache_misses'])
+    ])
+    add_metric('prebid_upload_store_entries', 'gauge', 'Uploads held in the server-side store', [({}, upload_entries)])
+    add_metric('prebid_upload_store_bytes', 'gauge', 'Approximate bytes held by the server-side upload store', [({}, upload_bytes)])
+    add_metric('prebid_analysis_jobs', 'gauge', 'Background analysis jobs by status', [
+        ({'status': status}, count) for status, count in sorted(job_statuses.items())
+    ])
+    
+    return '\n'.join(lines) + '\n'
+
+def truthy_mask(names, codes):
+    """Mask of codes whose decoded name is truthy, checking each distinct code once"""
+    unique_codes, inverse = np.unique(codes, return_inverse=True)
+    truthy = np.array([bool(name) for name in names[unique_codes]], dtype=bool)
+    return truthy[inverse.reshape(-1)]
+
+def first_seen_codes(codes):
+    """Distinct codes in order of first appearance"""
+    unique_codes, first_index = np.unique(codes, return_index=True)
+    return unique_codes[np.argsort(first_index, kind='stable')].tolist()
+
+def build_lane_analysis(store, positions):
+    """Aggregate a lane's rows into the transporter and vehicle type summaries used by the
+    lane helpers and /get_transporter_analysis, with bincounts over category codes.
+    
+    Groups keep first-seen row order before sorting, so ties come out as in a row-by-row loop.
+    """
+    vehicle_names = store['categories']['Vehicle Type (New)']
+    transporter_names = store['categories']['Transporter']
+    vehicle_codes = store['columns']['Vehicle Type (New)'][positions].astype(np.int64)
+    transporter_codes = store['columns']['Transporter'][positions].astype(np.int64)
+    rates = store['columns']['Shipper'][positions]
+    ratings = store['columns']['Rating'][positions]
+    vehicle_count = len(vehicle_names)
+    transporter_count = len(transporter_names)
+    
+    # NaN fails every comparison, so invalid sheet values drop out of the rate and rating masks
+    has_transporter = truthy_mask(transporter_names, transporter_codes)
+    has_vehicle = truthy_mask(vehicle_names, vehicle_codes)
+    priced = has_transporter & (rates > 0)
+    rated = ratings > 0
+    
+    # Transporter summary: priced rows, averaging only the positive ratings
+    t_codes = transporter_codes[priced]
+    t_rated = rated[priced]
+    trip_counts = np.bincount(t_codes, minlength=transporter_count).tolist()
+    rate_totals = np.bincount(t_codes, weights=rates[priced], minlength=transporter_count).tolist()
+    rating_counts = np.bincount(t_codes[t_rated], minlength=transporter_count).tolist()
+    rating_totals = np.bincount(t_codes[t_rated], weights=ratings[priced][t_rated], minlength=transporter_count).tolist()
+    
+    transporters = []
+    for code in first_seen_codes(t_codes):
+        valid_ratings = rating_counts[code]
+        transporters.append({
+            'name': transporter_names[code],
+            'total_rate': rate_totals[code],
+            'trip_count': trip_counts[code],
+            'avg_rate': rate_totals[code] / trip_counts[code],
+            'total_rating': rating_totals[code] if valid_ratings else 0,
+            'valid_ratings': valid_ratings,
+            'avg_rating': rating_totals[code] / valid_ratings if valid_ratings else None
+        })
+    
+    # Sort by average rating (if available) then by trip count, and tier the top 5
+    transporters.sort(key=lambda x: (x['avg_rating'] if x['avg_rating'] is not None else -1, x['trip_count']), reverse=True)
+    transporters = transporters[:5]
+    for t in transporters:
         if t['avg_rating'] is None:
             t['tier'] = 'Unrated'
         elif t['avg_rating'] > 4:
@@ -577,208 +2423,200 @@ def get_transporters_for_lane(origin, destination):
         else:
             t['tier'] = 'Bronze'
     
-    return top_transporters
-
-def get_vehicle_type_analysis(origin, destination):
-    """Get detailed analysis by vehicle type for the lane"""
-    data = get_sheet_data()
-    
-    # Filter data for the specific lane
-    lane_data = [
-        row for row in data 
-        if row.get('Origin cluster name') == origin 
-        and row.get('Destination cluster name') == destination
-        and row.get('Vehicle Type (New)')
-        and row.get('Transporter')
+    # Vehicle type analysis: priced rows that also have a vehicle type
+    vehicle_rows = priced & has_vehicle
+    v_codes = vehicle_codes[vehicle_rows]
+    v_rated = rated[vehicle_rows]
+    v_pairs = np.unique(v_codes * transporter_count + transporter_codes[vehicle_rows])
+    v_transporter_counts = np.bincount(v_pairs // max(transporter_count, 1), minlength=vehicle_count).tolist()
+    v_trips = np.bincount(v_codes, minlength=vehicle_count).tolist()
+    v_rate_totals = np.bincount(v_codes, weights=rates[vehicle_rows], minlength=vehicle_count).tolist()
+    v_rating_counts = np.bincount(v_codes[v_rated], minlength=vehicle_count).tolist()
+    v_rating_totals = np.bincount(v_codes[v_rated], weights=ratings[vehicle_rows][v_rated], minlength=vehicle_count).tolist()
+    
+    vehicle_types = [
+        {
+            'vehicle_type': vehicle_names[code],
+            'transporter_count': v_transporter_counts[code],
+            'total_trips': v_trips[code],
+            'avg_rating': round(v_rating_totals[code] / v_rating_counts[code], 2) if v_rating_counts[code] > 0 else None,
+            'avg_rate': round(v_rate_totals[code] / v_trips[code], 2)
+        }
+        for code in first_seen_codes(v_codes)
     ]
+    vehicle_types.sort(key=lambda x: x['total_trips'], reverse=True)
     
-    # Analyze by vehicle type
-    vehicle_analysis = {}
-    for row in lane_data:
-        vehicle_type = row['Vehicle Type (New)']
-        transporter = row['Transporter']
-        
-        try:
-            rate = float(row['Shipper'])
-            if rate <= 0:  # Skip invalid rates
-                continue
-                
-            # Handle rating - could be empty or invalid
-            rating = None
-            try:
-                if row.get('Rating'):
-                    rating = float(row['Rating'])
-                    if rating <= 0:  # Skip invalid ratings but keep the row
-                        rating = None
-            except (ValueError, TypeError):
-                rating = None
-            
-        except (ValueError, TypeError):
-            continue
-        
-        if vehicle_type not in vehicle_analysis:
-            vehicle_analysis[vehicle_type] = {
-                'vehicle_type': vehicle_type,
-                'transporters': set(),
-                'total_trips': 0,
-                'total_rating': 0,
-                'total_rate': 0,
-                'valid_ratings': 0  # Count for average rating calculation
-            }
+    # Transporter analysis: rows with a transporter and a non-zero rating; rows without a
+    # rate still list their vehicle type, with no trips
+    lane_rows = has_transporter & (ratings != 0) & ~np.isnan(ratings)
+    metric_rows = lane_rows & ~np.isnan(rates)
+    m_transporters = transporter_codes[metric_rows]
+    m_vehicles = vehicle_codes[metric_rows]
+    m_rates = rates[metric_rows]
+    m_ratings = ratings[metric_rows]
+    
+    m_trips = np.bincount(m_transporters, minlength=transporter_count).tolist()
+    m_rate_totals = np.bincount(m_transporters, weights=m_rates, minlength=transporter_count).tolist()
+    m_rating_totals = np.bincount(m_transporters, weights=m_ratings, minlength=transporter_count).tolist()
+    
+    # Vehicle types per transporter, added to each set in first-seen order
+    transporter_vehicles = {}
+    for pair in first_seen_codes(m_transporters * vehicle_count + m_vehicles):
+        transporter_vehicles.setdefault(pair // vehicle_count, []).append(vehicle_names[pair % vehicle_count])
+    
+    top_transporters = []
+    for code in first_seen_codes(m_transporters):
+        rating = m_rating_totals[code] / m_trips[code]
+        category = 'Bronze'
+        for cat, min_rating in RATING_CATEGORIES.items():
+            if rating >= min_rating:
+                category = cat
+                break
         
-        analysis = vehicle_analysis[vehicle_type]
-        analysis['transporters'].add(transporter)
-        analysis['total_trips'] += 1
-        if rating is not None:
-            analysis['total_rating'] += rating
-            analysis['valid_ratings'] += 1
-        analysis['total_rate'] += rate
-    
-    # Calculate averages and convert sets to counts
-    result = []
-    for analysis in vehicle_analysis.values():
-        result.append({
-            'vehicle_type': analysis['vehicle_type'],
-            'transporter_count': len(analysis['transporters']),
-            'total_trips': analysis['total_trips'],
-            'avg_rating': round(analysis['total_rating'] / analysis['valid_ratings'], 2) if analysis['valid_ratings'] > 0 else None,
-            'avg_rate': round(analysis['total_rate'] / analysis['total_trips'], 2)
+        top_transporters.append({
+            'name': transporter_names[code],
+            'rating': rating,
+            'category': category,
+            'trips': m_trips[code],
+            'avg_rate': m_rate_totals[code] / m_trips[code],
+            'vehicle_types': list(set(transporter_vehicles[code]))
+        })
+    
+    # Sort by rating and get top 5
+    top_transporters.sort(key=lambda x: x['rating'], reverse=True)
+    top_transporters = top_transporters[:5]
+    
+    vt_pairs = np.unique(m_vehicles * transporter_count + m_transporters)
+    vt_transporter_counts = np.bincount(vt_pairs // max(transporter_count, 1), minlength=vehicle_count).tolist()
+    vt_trips = np.bincount(m_vehicles, minlength=vehicle_count).tolist()
+    vt_rate_totals = np.bincount(m_vehicles, weights=m_rates, minlength=vehicle_count).tolist()
+    vt_rating_totals = np.bincount(m_vehicles, weights=m_ratings, minlength=vehicle_count).tolist()
+    
+    vehicle_type_summary = [
+        {
+            'vehicle_type': vehicle_names[code],
+            'transporter_count': vt_transporter_counts[code],
+            'trips': vt_trips[code],
+            'avg_rating': vt_rating_totals[code] / vt_trips[code] if vt_trips[code] > 0 else 0,
+            'avg_rate': vt_rate_totals[code] / vt_trips[code] if vt_trips[code] > 0 else 0
+        }
+        for code in first_seen_codes(vehicle_codes[lane_rows])
+    ]
+    
+    # Sort vehicle type summary by number of trips
+    vehicle_type_summary.sort(key=lambda x: x['trips'], reverse=True)
+    
+    # Add an "All Vehicle Types" summary
+    total_trips = sum(vt['trips'] for vt in vehicle_type_summary)
+    total_rate = sum(vt['avg_rate'] * vt['trips'] for vt in vehicle_type_summary)
+    total_rating = sum(vt['avg_rating'] * vt['trips'] for vt in vehicle_type_summary)
+    if total_trips > 0:
+        vehicle_type_summary.insert(0, {
+            'vehicle_type': 'All Vehicle Types',
+            'transporter_count': len(transporter_vehicles),
+            'trips': total_trips,
+            'avg_rating': total_rating / total_trips,
+            'avg_rate': total_rate / total_trips
         })
     
-    # Sort by total trips
-    result.sort(key=lambda x: x['total_trips'], reverse=True)
-    return result
+    return {
+        'transporters': transporters,
+        'vehicle_types': vehicle_types,
+        'top_transporters': top_transporters,
+        'vehicle_type_summary': vehicle_type_summary
+    }
+
+@memoize_per_sheet_version
+def get_lane_analysis(snapshot, origin, destination, vehicle_type=None):
+    """Get the transporter and vehicle type analytics for a lane, or for one vehicle type on it"""
+    positions = get_lane_positions(snapshot, origin, destination, vehicle_type)
+    return build_lane_analysis(snapshot['data'], positions)
+
+def get_transporters_for_lane(origin, destination):
+    """Get top 5 transporters with their ratings and metrics for a specific lane"""
+    return [dict(t) for t in get_lane_analysis(origin, destination)['transporters']]
+
+def get_vehicle_type_analysis(origin, destination):
+    """Get detailed analysis by vehicle type for the lane"""
+    return [dict(v) for v in get_lane_analysis(origin, destination)['vehicle_types']]
 
 @app.route('/get_transporter_analysis/<origin>/<destination>')
+@conditional_on_sheet_version()
 def get_transporter_analysis(origin, destination):
     try:
-        data = get_sheet_data()
-        
-        # Filter data for the selected lane
-        lane_data = [
-            row for row in data 
-            if row['Origin cluster name'] == origin 
-            and row['Destination cluster name'] == destination
-            and row['Transporter'] 
-            and row['Rating']
-        ]
-        
-        # Calculate transporter metrics
-        transporter_metrics = {}
-        for row in lane_data:
-            transporter = row['Transporter']
-            try:
-                rate = float(row['Shipper'])
-                rating = float(row['Rating'])
-                vehicle_type = row['Vehicle Type (New)']
-            except (ValueError, TypeError):
-                continue
-                
-            if transporter not in transporter_metrics:
-                transporter_metrics[transporter] = {
-                    'trips': 0,
-                    'total_rate': 0,
-                    'total_rating': 0,
-                    'rating': 0,
-                    'avg_rate': 0,
-                    'vehicle_types': set(),
-                    'latest_rating': rating
-                }
-            
-            metrics = transporter_metrics[transporter]
-            metrics['trips'] += 1
-            metrics['total_rate'] += rate
-            metrics['total_rating'] += rating
-            metrics['vehicle_types'].add(vehicle_type)
-            metrics['rating'] = metrics['total_rating'] / metrics['trips']
-            metrics['avg_rate'] = metrics['total_rate'] / metrics['trips']
-        
-        # Get top 5 transporters by rating
-        top_transporters = []
-        for transporter, metrics in transporter_metrics.items():
-            rating = metrics['rating']
-            category = 'Bronze'
-            for cat, min_rating in RATING_CATEGORIES.items():
-                if rating >= min_rating:
-                    category = cat
-                    break
-                    
-            top_transporters.append({
-                'name': transporter,
-                'rating': rating,
-                'category': category,
-                'trips': metrics['trips'],
-                'avg_rate': metrics['avg_rate'],
-                'vehicle_types': list(metrics['vehicle_types'])  # Add vehicle types to response
-            })
-        
-        # Sort by rating and get top 5
-        top_transporters.sort(key=lambda x: x['rating'], reverse=True)
-        top_transporters = top_transporters[:5]
+        analysis = get_lane_analysis(origin, destination)
+        return jsonify({
+            'top_transporters': analysis['top_transporters'],
+            'vehicle_type_summary': analysis['vehicle_type_summary']
+        })
         
-        # Calculate vehicle type metrics
-        vehicle_type_metrics = {}
-        for row in lane_data:
-            vehicle_type = row['Vehicle Type (New)']
-            if vehicle_type not in vehicle_type_metrics:
-                vehicle_type_metrics[vehicle_type] = {
-                    'transporters': set(),
-                    'trips': 0,
-                    'total_rating': 0,
-                    'total_rate': 0
-                }
-            
-            try:
-                rate = float(row['Shipper'])
-                rating = float(row['Rating'])
-            except (ValueError, TypeError):
-                continue
-                
-            metrics = vehicle_type_metrics[vehicle_type]
-            metrics['transporters'].add(row['Transporter'])
-            metrics['trips'] += 1
-            metrics['total_rating'] += rating
-            metrics['total_rate'] += rate
+    except Exception as e:
+        print(f"Error in transporter analysis: {str(e)}")
+        return jsonify({'error': 'Error analyzing transporter data'}), 500
+
+def parse_batch_lanes(payload):
+    """Get (origin, destination[, vehicle type]) tuples from a batch request body, or raise
+    ValueError. Lanes are given as objects or as 2- or 3-item arrays."""
+    lanes = payload.get('lanes') if isinstance(payload, dict) else None
+    if not isinstance(lanes, list) or not lanes:
+        raise ValueError('Expected a non-empty "lanes" list')
+    if len(lanes) > LANE_BATCH_MAX_LANES:
+        raise ValueError(f'At most {LANE_BATCH_MAX_LANES} lanes can be analyzed per request')
+    
+    parsed = []
+    for lane in lanes:
+        if isinstance(lane, dict):
+            lane = [lane.get('origin'), lane.get('destination'), lane.get('vehicle_type')]
+        if (not isinstance(lane, list) or len(lane) not in (2, 3) or lane[0] is None or lane[1] is None
+                or not all(value is None or isinstance(value, (str, int, float)) for value in lane)):
+            raise ValueError('Each lane needs an origin and a destination')
+        if len(lane) == 3 and lane[2] is None:
+            lane = lane[:2]
+        parsed.append(tuple(lane))
+    return parsed
+
+@app.route('/get_transporter_analysis_batch', methods=['POST'])
+def get_transporter_analysis_batch():
+    """Transporter and vehicle type analysis for many lanes in one request.
+    
+    Lanes come from the lane index, so the sheet is never rescanned per lane, and repeated
+    lanes are analyzed once. With "parallel": true distinct lanes are analyzed on a thread pool.
+    """
+    payload = request.get_json(silent=True)
+    try:
+        lanes = parse_batch_lanes(payload)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        # Analyze every lane against the version reported, also on the pool's threads
+        snapshot = get_sheet_snapshot()
+        version = snapshot['version']
+        distinct_lanes = list(dict.fromkeys(lanes))
+        if payload.get('parallel') is True:
+            with ThreadPoolExecutor(max_workers=LANE_BATCH_WORKERS) as executor:
+                analyses = list(executor.map(lambda lane: get_lane_analysis(*lane, snapshot=snapshot), distinct_lanes))
+        else:
+            analyses = [get_lane_analysis(*lane, snapshot=snapshot) for lane in distinct_lanes]
+        analyses = dict(zip(distinct_lanes, analyses))
         
-        # Calculate averages for vehicle types
-        vehicle_type_summary = []
-        for vehicle_type, metrics in vehicle_type_metrics.items():
-            vehicle_type_summary.append({
-                'vehicle_type': vehicle_type,
-                'transporter_count': len(metrics['transporters']),
-                'trips': metrics['trips'],
-                'avg_rating': metrics['total_rating'] / metrics['trips'] if metrics['trips'] > 0 else 0,
-                'avg_rate': metrics['total_rate'] / metrics['trips'] if metrics['trips'] > 0 else 0
+        results = []
+        for lane in lanes:
+            analysis = analyses[lane]
+            results.append({
+                'origin': lane[0],
+                'destination': lane[1],
+                'vehicle_type': lane[2] if len(lane) == 3 else None,
+                'top_transporters': analysis['top_transporters'],
+                'vehicle_type_summary': analysis['vehicle_type_summary']
             })
         
-        # Sort vehicle type summary by number of trips
-        vehicle_type_summary.sort(key=lambda x: x['trips'], reverse=True)
-        
-        # Add an "All Vehicle Types" summary
-        total_trips = sum(vt['trips'] for vt in vehicle_type_summary)
-        total_rate = sum(vt['avg_rate'] * vt['trips'] for vt in vehicle_type_summary)
-        total_rating = sum(vt['avg_rating'] * vt['trips'] for vt in vehicle_type_summary)
-        unique_transporters = set()
-        for vt in vehicle_type_metrics.values():
-            unique_transporters.update(vt['transporters'])
-            
-        if total_trips > 0:
-            all_vehicle_types_summary = {
-                'vehicle_type': 'All Vehicle Types',
-                'transporter_count': len(unique_transporters),
-                'trips': total_trips,
-                'avg_rating': total_rating / total_trips,
-                'avg_rate': total_rate / total_trips
-            }
-            vehicle_type_summary.insert(0, all_vehicle_types_summary)
-        
         return jsonify({
-            'top_transporters': top_transporters,
-            'vehicle_type_summary': vehicle_type_summary
+            'version': version,
+            'results': results
         })
-        
     except Exception as e:
-        print(f"Error in transporter analysis: {str(e)}")
+        print(f"Error in batch transporter analysis: {str(e)}")
         return jsonify({'error': 'Error analyzing transporter data'}), 500
 
 if __name__ == '__main__':
@@ -32,6 +32,7 @@ document.addEventListener('DOMContentLoaded', function() {
     
     let selectedFiles = [];
     let currentAnalysisResults = null;
+    let laneTree = null;  // origin -> destination -> vehicle types offered by the filter dropdowns
 
     // Utility functions for formatting
     function formatCurrency(amount) {
@@ -235,8 +236,8 @@ document.addEventListener('DOMContentLoaded', function() {
             // Display the analysis results
             displayAnalysisResults(data.results);
             
-            // Populate origin dropdown with uploaded data
-            populateOriginDropdown(data.origins);
+            // Populate the dropdowns from the lane tree, or the uploaded origins without it
+            loadLaneTree(data.origins);
             
             // Scroll to analysis section
             analysisContainer.scrollIntoView({ behavior: 'smooth' });
@@ -385,14 +386,7 @@ document.addEventListener('DOMContentLoaded', function() {
         // Show loading state
         showLoading(destinationSelect);
         
-        // Fetch destinations from Google Sheets data with encoded origin
-        fetch(`/get_destinations/${encodeURIComponent(origin)}`)
-            .then(response => {
-                if (!response.ok) {
-                    throw new Error(`HTTP error! status: ${response.status}`);
-                }
-                return response.json();
-            })
+        getDestinations(origin)
             .then(destinations => {
                 destinationSelect.innerHTML = '<option value="">Select Destination</option>';
                 destinations.forEach(dest => {
@@ -428,14 +422,7 @@ document.addEventListener('DOMContentLoaded', function() {
         // Show loading state
         showLoading(vehicleTypeSelect);
         
-        // Fetch vehicle types from Google Sheets data with encoded parameters
-        fetch(`/get_vehicle_types/${encodeURIComponent(origin)}/${encodeURIComponent(destination)}`)
-            .then(response => {
-                if (!response.ok) {
-                    throw new Error(`HTTP error! status: ${response.status}`);
-                }
-                return response.json();
-            })
+        getVehicleTypes(origin, destination)
             .then(vehicleTypes => {
                 vehicleTypeSelect.innerHTML = '<option value="">Select Vehicle Type</option><option value="ALL">Select All</option>';
                 vehicleTypes.forEach(type => {
@@ -469,26 +456,39 @@ document.addEventListener('DOMContentLoaded', function() {
         // Show loading state
         setButtonLoading(this, true, 'Analyzing...');
         
-        // Find the matching lanes in the current analysis results
-        let filteredLanes = [];
-        if (vehicleType === 'ALL') {
-            // If "Select All" is chosen, get all lanes for the origin-destination pair
-            filteredLanes = currentAnalysisResults.all_lane_differences.filter(lane => 
-                lane.origin === origin && 
-                lane.destination === destination
-            );
-        } else {
-            // Find specific vehicle type
-            const filteredLane = currentAnalysisResults.all_lane_differences.find(lane => 
-            lane.origin === origin && 
-            lane.destination === destination && 
-            lane.vehicle_type === vehicleType
-        );
-            if (filteredLane) {
-                filteredLanes = [filteredLane];
-            }
+        // Fetch the matching lanes from the analysis results kept on the server
+        const params = new URLSearchParams({
+            origin: origin,
+            destination: destination,
+            limit: 1000
+        });
+        if (vehicleType !== 'ALL') {
+            // Otherwise "Select All" gets all lanes for the origin-destination pair
+            params.set('vehicle_type', vehicleType);
         }
         
+        fetch(`/lane_differences?${params.toString()}`)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error('Server returned an error response');
+                }
+                return response.json();
+            })
+            .then(data => {
+                showLaneLevelAnalysis(data.lane_differences);
+                
+                // Reset button state
+                setButtonLoading(this, false, 'Apply Filters');
+            })
+            .catch(error => {
+                console.error('Error fetching lane differences:', error);
+                alert('Error loading lane analysis. Please try again.');
+                setButtonLoading(this, false, 'Apply Filters');
+            });
+    });
+    
+    // Show the lane level analysis for the filtered lanes
+    function showLaneLevelAnalysis(filteredLanes) {
         if (filteredLanes.length > 0) {
             // Show the lane level analysis section
             const laneLevelAnalysis = document.getElementById('lane-level-analysis');
@@ -554,10 +554,57 @@ document.addEventListener('DOMContentLoaded', function() {
             alert('No data found for the selected combination');
             document.getElementById('lane-level-analysis').style.display = 'none';
         }
-        
-        // Reset button state
-        setButtonLoading(this, false, 'Apply Filters');
-    });
+    }
+
+    // Fetch every origin, destination and vehicle type choice for the upload at once, so the
+    // cascading dropdowns are filled locally instead of with a request per selection
+    function loadLaneTree(fallbackOrigins) {
+        laneTree = null;
+        fetchJson('/lane_tree')
+            .then(data => {
+                // Names are sent once and referenced by index
+                const names = data.names;
+                laneTree = new Map(data.tree.map(([origin, destinations]) => [
+                    names[origin],
+                    new Map(destinations.map(([destination, vehicleTypes]) => [
+                        names[destination],
+                        vehicleTypes.map(code => names[code])
+                    ]))
+                ]));
+                // Origins come in dropdown order, so all three dropdowns share one sheet version
+                populateOriginDropdown(Array.from(laneTree.keys()));
+            })
+            .catch(error => {
+                // The dropdowns fall back to asking the server for each selection
+                console.error('Error fetching lane tree:', error);
+                populateOriginDropdown(fallbackOrigins);
+            });
+    }
+
+    function fetchJson(url) {
+        return fetch(url).then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            return response.json();
+        });
+    }
+
+    function getDestinations(origin) {
+        if (laneTree) {
+            const destinations = laneTree.get(origin);
+            return Promise.resolve(destinations ? Array.from(destinations.keys()) : []);
+        }
+        return fetchJson(`/get_destinations/${encodeURIComponent(origin)}`);
+    }
+
+    function getVehicleTypes(origin, destination) {
+        if (laneTree) {
+            const destinations = laneTree.get(origin);
+            return Promise.resolve((destinations && destinations.get(destination)) || []);
+        }
+        return fetchJson(`/get_vehicle_types/${encodeURIComponent(origin)}/${encodeURIComponent(destination)}`);
+    }
 
     function populateOriginDropdown(origins) {
         // Populate both origin dropdowns
@@ -595,14 +642,7 @@ document.addEventListener('DOMContentLoaded', function() {
         // Show loading state
         showLoading(transporterDestinationSelect);
         
-        // Fetch destinations from Google Sheets data with encoded origin
-        fetch(`/get_destinations/${encodeURIComponent(origin)}`)
-            .then(response => {
-                if (!response.ok) {
-                    throw new Error(`HTTP error! status: ${response.status}`);
-                }
-                return response.json();
-            })
+        getDestinations(origin)
             .then(destinations => {
                 transporterDestinationSelect.innerHTML = '<option value="">Select Destination</option>';
                 destinations.forEach(dest => {
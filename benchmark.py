@@ -0,0 +1,313 @@
+"""Benchmarks for the sheet load, upload analysis and lane endpoints on synthetic data.
+
+Generates a benchmark sheet with a configurable number of rows, lanes and transporters, with
+lane and transporter popularity following a Zipf-like skew, and serves it to app.py through
+the local Sheets stand-in. Results are written as JSON so two runs can be compared:
+
+    python benchmark.py run --rows 200000 --output before.json
+    python benchmark.py run --rows 200000 --output after.json
+    python benchmark.py compare before.json after.json
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+SHEET_HEADER = ['Trip ID', 'Origin cluster name', 'Destination cluster name', 'Vehicle Type (New)',
+                'Shipper', 'Transporter', 'Rating']
+UPLOAD_HEADER = ['Origin cluster name', 'Destination cluster name', 'Vehicle Type (New)', 'Shipper', 'Vehicle Type']
+VEHICLE_TYPES = ['14ft', '17ft', '19ft', '20ft', '22ft', '24ft', '32ft SXL', '32ft MXL']
+
+# Median seconds may grow by this fraction before compare reports a regression
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+
+def zipf_weights(count, skew):
+    """Probabilities for count items where item i is proportional to 1 / (i + 1) ** skew"""
+    weights = 1.0 / np.arange(1, count + 1) ** skew
+    return weights / weights.sum()
+
+
+def generate_lanes(lane_count, rng):
+    """Distinct (origin, destination, vehicle type) lanes over a city pool sized for lane_count"""
+    city_count = max(2, int(np.ceil(np.sqrt(lane_count / len(VEHICLE_TYPES)))) + 1)
+    cities = [f'City {i:03d}' for i in range(city_count)]
+    lanes = set()
+    while len(lanes) < lane_count:
+        origin, destination = rng.choice(city_count, size=2, replace=False)
+        lanes.add((cities[origin], cities[destination], VEHICLE_TYPES[rng.integers(len(VEHICLE_TYPES))]))
+    lanes = sorted(lanes)
+    # Shuffle so that lane popularity is unrelated to the name order
+    return [lanes[i] for i in rng.permutation(len(lanes))]
+
+
+def generate_sheet_rows(rows, lanes, transporter_count, skew, rng):
+    """Benchmark sheet rows with skewed lane and transporter popularity"""
+    lane_choice = rng.choice(len(lanes), size=rows, p=zipf_weights(len(lanes), skew))
+    transporter_choice = rng.choice(transporter_count, size=rows, p=zipf_weights(transporter_count, skew))
+    base_rates = rng.uniform(8000, 90000, size=len(lanes))
+    rates = np.round(base_rates[lane_choice] * rng.normal(1.0, 0.12, size=rows)).astype(int)
+    ratings = rng.integers(1, 6, size=rows)
+
+    for i in range(rows):
+        origin, destination, vehicle_type = lanes[lane_choice[i]]
+        yield [i + 1, origin, destination, vehicle_type, max(int(rates[i]), 1),
+               f'Transporter {transporter_choice[i]:04d}', int(ratings[i])]
+
+
+def generate_upload_csv(rows, lanes, skew, rng, unknown_fraction=0.1):
+    """An uploaded rates CSV in memory, with a fraction of rows on lanes missing from the sheet"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(UPLOAD_HEADER)
+    lane_choice = rng.choice(len(lanes), size=rows, p=zipf_weights(len(lanes), skew))
+    unknown = rng.random(rows) < unknown_fraction
+    rates = rng.uniform(8000, 90000, size=rows).round()
+    for i in range(rows):
+        origin, destination, vehicle_type = lanes[lane_choice[i]]
+        if unknown[i]:
+            origin = f'Unlisted {origin}'
+        writer.writerow([origin, destination, vehicle_type, int(rates[i]), vehicle_type])
+    return buffer.getvalue().encode('utf-8')
+
+
+def write_sheet_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(SHEET_HEADER)
+        writer.writerows(rows)
+
+
+def measure(name, func, repeat, items=None, setup=None):
+    """Time func over repeat runs, then run it once more under tracemalloc for peak memory.
+
+    setup, if given, runs before every call and is not timed. items is the number of rows or
+    requests one call handles, used for the throughput figure.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(timings)
+    result = {
+        'runs': repeat,
+        'seconds': {
+            'min': min(timings),
+            'median': median,
+            'mean': statistics.mean(timings),
+            'max': max(timings)
+        },
+        'items': items,
+        'items_per_second': items / median if items and median > 0 else None,
+        'peak_memory_bytes': peak
+    }
+    throughput = f", {result['items_per_second']:,.0f}/s" if result['items_per_second'] else ''
+    print(f'{name:<48} {median * 1000:10.2f} ms{throughput}, peak {peak / 1024 / 1024:.1f} MiB')
+    return result
+
+
+def get_json(client, url, method='get', **kwargs):
+    """Request url and fail the benchmark on an error status, so broken endpoints aren't timed"""
+    response = getattr(client, method)(url, **kwargs)
+    if response.status_code >= 400:
+        raise RuntimeError(f'{url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}')
+    return response.get_json()
+
+
+def run_benchmarks(args):
+    rng = np.random.default_rng(args.seed)
+    lanes = generate_lanes(args.lanes, rng)
+    work_dir = tempfile.mkdtemp(prefix='prebid-benchmark-')
+    sheet_path = os.path.join(work_dir, 'sheet.csv')
+    write_sheet_csv(sheet_path, generate_sheet_rows(args.rows, lanes, args.transporters, args.skew, rng))
+    upload_sizes = [int(size) for size in args.upload_sizes.split(',') if size]
+    if not upload_sizes:
+        raise SystemExit('--upload-sizes needs at least one size')
+    uploads = {size: generate_upload_csv(size, lanes, args.skew, rng) for size in upload_sizes}
+
+    # app.py reads its configuration at import time, so point it at the synthetic sheet first
+    os.environ['SHEET_FIXTURE_CSV'] = sheet_path
+    os.environ['SHEET_SNAPSHOT_DIR'] = ''
+    os.environ['SHEET_SNAPSHOT_SHARING'] = 'process'
+    os.environ['PROFILING'] = 'off'
+    os.environ.setdefault('GOOGLE_SHEET_ID', 'benchmark')
+    os.environ.setdefault('GOOGLE_SHEET_NAME', 'Collective Data')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as prebid_app
+
+    results = {}
+
+    def reset_sheet_cache():
+        prebid_app.sheet_data_cache['snapshot'] = None
+        prebid_app.clear_sheet_memo()
+
+    def load_sheet():
+        with prebid_app.sheet_refresh_lock:
+            prebid_app.refresh_sheet_data()
+
+    results['sheet_load'] = measure('sheet load (fetch, store, indexes, aggregates)', load_sheet,
+                                    args.repeat, items=args.rows, setup=reset_sheet_cache)
+    load_sheet()
+
+    client = prebid_app.app.test_client()
+
+    def analyze(size):
+        get_json(client, '/analyze_rates', method='post',
+                 data={'file': (io.BytesIO(uploads[size]), 'rates.csv')},
+                 content_type='multipart/form-data')
+
+    def forget_analyzed_uploads():
+        # Re-uploads of the same file reuse the stored analysis, so drop it to time a full one
+        with prebid_app.upload_store_lock:
+            prebid_app.upload_fingerprints.clear()
+
+    for size in upload_sizes:
+        results[f'analyze_rates[{size}]'] = measure(f'/analyze_rates {size} rows', lambda size=size: analyze(size),
+                                                    args.repeat, items=size, setup=forget_analyzed_uploads)
+        results[f'analyze_rates[{size}][cached]'] = measure(f'/analyze_rates {size} rows cached',
+                                                            lambda size=size: analyze(size), args.repeat, items=size)
+
+    # Leave the largest upload in the session for the endpoints that combine it with the sheet
+    analyze(max(upload_sizes))
+    sample = [lanes[i] for i in rng.choice(len(lanes), size=min(args.sample_lanes, len(lanes)), replace=False)]
+    origins = sorted({origin for origin, _, _ in sample})
+
+    lane_endpoints = [
+        ('get_destinations', lambda o, d, v: f'/get_destinations/{o}', origins),
+        ('get_uploaded_destinations', lambda o, d, v: f'/get_uploaded_destinations/{o}', origins),
+        ('get_vehicle_types', lambda o, d, v: f'/get_vehicle_types/{o}/{d}', sample),
+        ('get_uploaded_vehicle_types', lambda o, d, v: f'/get_uploaded_vehicle_types/{o}/{d}', sample),
+        ('get_transporter_analysis', lambda o, d, v: f'/get_transporter_analysis/{o}/{d}', sample),
+    ]
+    for name, build_url, keys in lane_endpoints:
+        urls = [build_url(*(key if isinstance(key, tuple) else (key, None, None))) for key in keys]
+
+        def request_all(urls=urls):
+            for url in urls:
+                get_json(client, url)
+        # Cold runs clear the per-version memo first, warm runs are served from it
+        results[f'{name}[cold]'] = measure(f'/{name} x{len(urls)} cold', request_all, args.repeat,
+                                           items=len(urls), setup=prebid_app.clear_sheet_memo)
+        results[f'{name}[warm]'] = measure(f'/{name} x{len(urls)} warm', request_all, args.repeat, items=len(urls))
+
+    batch = {'lanes': [{'origin': o, 'destination': d} for o, d, _ in sample]}
+    results['get_transporter_analysis_batch'] = measure(
+        f'/get_transporter_analysis_batch {len(sample)} lanes',
+        lambda: get_json(client, '/get_transporter_analysis_batch', method='post', json=batch),
+        args.repeat, items=len(sample), setup=prebid_app.clear_sheet_memo)
+    results['lane_differences'] = measure(
+        '/lane_differences first page',
+        lambda: get_json(client, '/lane_differences?sort=abs_difference&limit=100'),
+        args.repeat, items=1)
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'git_revision': get_git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'parameters': {name: value for name, value in vars(args).items() if name not in ('command', 'output')}
+        },
+        'results': results
+    }
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(baseline_path, candidate_path, threshold):
+    """Print the median time and peak memory change of each benchmark. Returns the regressions."""
+    with open(baseline_path, encoding='utf-8') as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(candidate_path, encoding='utf-8') as candidate_file:
+        candidate = json.load(candidate_file)
+
+    if baseline['meta']['parameters'] != candidate['meta']['parameters']:
+        print('Warning: the runs used different parameters, so timings may not be comparable')
+
+    regressions = []
+    print(f"{'benchmark':<40} {'baseline ms':>12} {'candidate ms':>12} {'time':>8} {'memory':>8}")
+    for name, old in baseline['results'].items():
+        new = candidate['results'].get(name)
+        if new is None:
+            print(f'{name:<40} missing from {candidate_path}')
+            continue
+        old_seconds, new_seconds = old['seconds']['median'], new['seconds']['median']
+        time_change = new_seconds / old_seconds - 1 if old_seconds else 0
+        memory_change = new['peak_memory_bytes'] / old['peak_memory_bytes'] - 1 if old['peak_memory_bytes'] else 0
+        flag = ''
+        if time_change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:<40} {old_seconds * 1000:12.2f} {new_seconds * 1000:12.2f} '
+              f'{time_change:+8.1%} {memory_change:+8.1%}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run the benchmarks and save the results')
+    run_parser.add_argument('--rows', type=int, default=100000, help='Benchmark sheet rows')
+    run_parser.add_argument('--lanes', type=int, default=2000, help='Distinct ODVT lanes in the sheet')
+    run_parser.add_argument('--transporters', type=int, default=300, help='Distinct transporters in the sheet')
+    run_parser.add_argument('--skew', type=float, default=1.0, help='Zipf exponent of lane and transporter popularity, 0 for uniform')
+    run_parser.add_argument('--upload-sizes', default='1000,10000,100000', help='Comma separated uploaded CSV row counts')
+    run_parser.add_argument('--sample-lanes', type=int, default=200, help='Lanes requested per lane endpoint benchmark')
+    run_parser.add_argument('--repeat', type=int, default=5, help='Timed runs per benchmark')
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--output', default='benchmark-results.json')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two saved benchmark results')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                                help='Fractional median slowdown reported as a regression')
+
+    args = parser.parse_args()
+    if args.command == 'compare':
+        regressions = compare_results(args.baseline, args.candidate, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+        return
+
+    output = args.output
+    report = run_benchmarks(args)
+    with open(output, 'w', encoding='utf-8') as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+"""Concurrent load test of app.py against the local Sheets API stand-in.
+
+Starts a LocalSheetsServer with a synthetic sheet and injectable latency and failures, runs the
+app in a separate process pointed at it through SHEETS_API_ENDPOINT, and drives a weighted mix
+of page, filter, analysis and upload requests at each concurrency level. For every level it
+reports throughput, latency percentiles and the upstream Sheets calls made. A stampede phase
+then clears the sheet cache and sends a burst of simultaneous requests, to check that one
+refresh serves them all.
+
+    python loadtest.py --rows 100000 --concurrency 1,8,32 --duration 15 --latency 0.3
+"""
+import argparse
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+import numpy as np
+
+from benchmark import generate_upload_csv, zipf_weights
+from local_sheets import LocalSheetsServer, build_synthetic_service
+
+# Relative weight of each request kind in the load mix
+DEFAULT_MIX = 'index=1,destinations=3,vehicle_types=3,transporter_analysis=4,analyze_rates=0.2'
+REQUEST_TIMEOUT = 120
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        if name not in REQUEST_KINDS:
+            raise SystemExit(f"Unknown request kind '{name}', expected one of {', '.join(REQUEST_KINDS)}")
+        weights[name] = float(weight)
+    return weights
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize_latencies(latencies):
+    latencies = sorted(latencies)
+    return {
+        'p50_ms': percentile(latencies, 0.50) * 1000 if latencies else None,
+        'p90_ms': percentile(latencies, 0.90) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        'max_ms': latencies[-1] * 1000 if latencies else None
+    }
+
+
+def multipart_body(field, filename, content):
+    """Encode one file field as multipart/form-data, returning (body, content type)"""
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+               f'Content-Type: text/csv\r\n\r\n'.encode('utf-8'))
+    body.write(content)
+    body.write(f'\r\n--{boundary}--\r\n'.encode('utf-8'))
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+class LoadClient:
+    """One simulated user with its own session cookie"""
+
+    def __init__(self, app_url, upload_csv):
+        self.app_url = app_url.rstrip('/')
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()))
+        self.upload_body, self.upload_type = multipart_body('file', 'rates.csv', upload_csv)
+
+    def request(self, path, data=None, content_type=None):
+        """Send a request and return its status, or 0 if the connection failed"""
+        request = Request(self.app_url + path, data=data)
+        if content_type:
+            request.add_header('Content-Type', content_type)
+        try:
+            with self.opener.open(request, timeout=REQUEST_TIMEOUT) as response:
+                response.read()
+                return response.status
+        except HTTPError as e:
+            e.read()
+            return e.code
+        except (URLError, OSError):
+            return 0
+
+    def upload(self):
+        return self.request('/analyze_rates', data=self.upload_body, content_type=self.upload_type)
+
+
+def lane_path(template, lane):
+    origin, destination, _ = lane
+    return template.format(origin=quote(origin, safe=''), destination=quote(destination, safe=''))
+
+
+REQUEST_KINDS = {
+    'index': lambda client, lane: client.request('/'),
+    'destinations': lambda client, lane: client.request(lane_path('/get_destinations/{origin}', lane)),
+    'vehicle_types': lambda client, lane: client.request(lane_path('/get_vehicle_types/{origin}/{destination}', lane)),
+    'transporter_analysis': lambda client, lane: client.request(
+        lane_path('/get_transporter_analysis/{origin}/{destination}', lane)),
+    'analyze_rates': lambda client, lane: client.upload()
+}
+
+
+def run_level(app_url, server, concurrency, duration, mix, lanes, lane_weights, upload_csv, seed):
+    """Run concurrency clients through the mix for duration seconds and summarize the results"""
+    kinds = list(mix)
+    kind_weights = [mix[kind] for kind in kinds]
+    records = []
+    records_lock = threading.Lock()
+    clients = [LoadClient(app_url, upload_csv) for _ in range(concurrency)]
+    # Every client needs an upload in its session before the filter routes answer
+    for client in clients:
+        client.upload()
+
+    server.reset_stats()
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def run_client(index):
+        rng = random.Random(seed * 1000 + index)
+        client = clients[index]
+        local_records = []
+        while time.perf_counter() < deadline:
+            kind = rng.choices(kinds, kind_weights)[0]
+            lane = lanes[rng.choices(range(len(lanes)), lane_weights)[0]]
+            request_start = time.perf_counter()
+            status = REQUEST_KINDS[kind](client, lane)
+            local_records.append((kind, time.perf_counter() - request_start, status))
+        with records_lock:
+            records.extend(local_records)
+
+    threads = [threading.Thread(target=run_client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    result = summarize_records(records, elapsed)
+    result['concurrency'] = concurrency
+    result['upstream'] = server.get_stats()
+    return result
+
+
+def summarize_records(records, elapsed):
+    errors = sum(1 for _, _, status in records if status == 0 or status >= 400)
+    by_kind = {}
+    for kind in sorted({kind for kind, _, _ in records}):
+        kind_records = [(latency, status) for record_kind, latency, status in records if record_kind == kind]
+        by_kind[kind] = dict(
+            summarize_latencies([latency for latency, _ in kind_records]),
+            requests=len(kind_records),
+            errors=sum(1 for _, status in kind_records if status == 0 or status >= 400)
+        )
+    return dict(
+        summarize_latencies([latency for _, latency, _ in records]),
+        requests=len(records),
+        errors=errors,
+        seconds=elapsed,
+        requests_per_second=len(records) / elapsed if elapsed > 0 else 0,
+        by_kind=by_kind
+    )
+
+
+def run_stampede(app_url, server, clients_count, lanes, upload_csv):
+    """Clear the app's sheet cache, then send clients_count lane analyses at the same moment"""
+    clients = [LoadClient(app_url, upload_csv) for _ in range(clients_count)]
+    for client in clients:
+        client.upload()
+    clients[0].request('/clear_cache')
+    server.reset_stats()
+
+    barrier = threading.Barrier(clients_count)
+    records = []
+    records_lock = threading.Lock()
+
+    def run_client(index):
+        lane = lanes[index % len(lanes)]
+        barrier.wait()
+        request_start = time.perf_counter()
+        status = REQUEST_KINDS['transporter_analysis'](clients[index], lane)
+        with records_lock:
+            records.append(('transporter_analysis', time.perf_counter() - request_start, status))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=run_client, args=(i,)) for i in range(clients_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    result = summarize_records(records, time.perf_counter() - start)
+    result['clients'] = clients_count
+    result['upstream'] = server.get_stats()
+    return result
+
+
+def find_free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def start_app(sheets_url, cache_timeout, log_file):
+    """Run app.py on a free port in a child process and wait until it answers"""
+    port = find_free_port()
+    env = dict(os.environ,
+               SHEETS_API_ENDPOINT=sheets_url,
+               SHEET_SNAPSHOT_DIR='',
+               SHEET_SNAPSHOT_SHARING='process',
+               PROFILING='off',
+               CACHE_TIMEOUT=str(cache_timeout),
+               GOOGLE_SHEET_ID=os.getenv('GOOGLE_SHEET_ID', 'loadtest'),
+               GOOGLE_SHEET_NAME=os.getenv('GOOGLE_SHEET_NAME', 'Collective Data'))
+    code = f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True, use_reloader=False)"
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    app_url = f'http://127.0.0.1:{port}'
+    for _ in range(300):
+        if process.poll() is not None:
+            raise SystemExit(f'app.py exited with status {process.returncode}, see {log_file.name}')
+        try:
+            with build_opener().open(app_url + '/cache_status', timeout=1):
+                return process, app_url
+        except (URLError, OSError):
+            time.sleep(0.1)
+    process.terminate()
+    raise SystemExit(f'app.py did not start, see {log_file.name}')
+
+
+def print_result(label, result):
+    upstream = result['upstream']
+    print(f"{label:<18} {result['requests']:>8} {result['requests_per_second']:>9.1f} {result['errors']:>7} "
+          f"{result['p50_ms'] or 0:>9.1f} {result['p90_ms'] or 0:>9.1f} {result['p99_ms'] or 0:>9.1f} "
+          f"{result['max_ms'] or 0:>9.1f} {upstream['get'] + upstream['batchGet']:>9} {upstream['failures']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='Synthetic sheet rows')
+    parser.add_argument('--lanes', type=int, default=2000, help='Distinct ODVT lanes in the sheet')
+    parser.add_argument('--transporters', type=int, default=300, help='Distinct transporters in the sheet')
+    parser.add_argument('--skew', type=float, default=1.0, help='Zipf exponent of lane popularity in the sheet and requests')
+    parser.add_argument('--upload-rows', type=int, default=2000, help='Rows in each client\'s uploaded CSV')
+    parser.add_argument('--concurrency', default='1,4,16,32', help='Comma separated client counts, run in order')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per concurrency level')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Comma separated kind=weight request mix')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds added to every Sheets API call')
+    parser.add_argument('--jitter', type=float, default=0.1, help='Up to this many more seconds per Sheets API call')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of Sheets API calls that fail')
+    parser.add_argument('--cache-timeout', type=int, default=300,
+                        help='CACHE_TIMEOUT for the app, lower it to see refreshes under load')
+    parser.add_argument('--stampede-clients', type=int, default=32, help='Simultaneous requests after a cache clear, 0 to skip')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    service, lanes = build_synthetic_service(args.rows, args.lanes, args.transporters, args.skew, args.seed)
+    lane_weights = zipf_weights(len(lanes), args.skew).tolist()
+    upload_csv = generate_upload_csv(args.upload_rows, lanes, args.skew, np.random.default_rng(args.seed + 1))
+
+    server = LocalSheetsServer(('127.0.0.1', 0), service, latency=args.latency, latency_jitter=args.jitter,
+                               failure_rate=args.failure_rate, seed=args.seed)
+    server.serve_in_thread()
+    log_file = tempfile.NamedTemporaryFile('w', prefix='prebid-loadtest-', suffix='.log', delete=False)
+    process, app_url = start_app(server.url, args.cache_timeout, log_file)
+    print(f'Sheets stand-in at {server.url} with {args.rows} rows, app at {app_url}, app log in {log_file.name}')
+
+    report = {'parameters': vars(args), 'levels': [], 'stampede': None}
+    try:
+        # Load the sheet once so the first level doesn't measure the cold fetch
+        LoadClient(app_url, upload_csv).request('/')
+
+        print(f"{'run':<18} {'requests':>8} {'req/s':>9} {'errors':>7} {'p50 ms':>9} {'p90 ms':>9} "
+              f"{'p99 ms':>9} {'max ms':>9} {'upstream':>9} {'failures':>9}")
+        for concurrency in [int(level) for level in args.concurrency.split(',') if level]:
+            result = run_level(app_url, server, concurrency, args.duration, mix, lanes, lane_weights,
+                               upload_csv, args.seed)
+            report['levels'].append(result)
+            print_result(f'{concurrency} clients', result)
+
+        if args.stampede_clients > 0:
+            result = run_stampede(app_url, server, args.stampede_clients, lanes, upload_csv)
+            report['stampede'] = result
+            print_result(f'stampede x{args.stampede_clients}', result)
+            # A refresh reads the header and then the data columns, so one refresh is 2 upstream calls
+            print(f"Stampede made {result['upstream']['get'] + result['upstream']['batchGet']} upstream calls "
+                  f"for {args.stampede_clients} simultaneous requests, at most "
+                  f"{result['upstream']['max_in_flight']} at a time")
+    finally:
+        process.terminate()
+        process.wait()
+        server.shutdown()
+        log_file.close()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+"""Local stand-in for the parts of the Google Sheets values API used by app.py.
+
+Serves a single sheet held in memory (for example loaded from a CSV fixture) through the
+same `service.spreadsheets().values().get(...).execute()` call chain as the real client.
+
+It can also run as an HTTP server for the values.get and values.batchGet endpoints, with
+injectable latency and failures, so the app can be load-tested with its real Sheets client:
+
+    python local_sheets.py --rows 200000 --port 8085 --latency 0.3 --failure-rate 0.01
+    SHEETS_API_ENDPOINT=http://127.0.0.1:8085/ python app.py
+"""
+import argparse
+import csv
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+# Values API paths, with the range URL-encoded as the googleapiclient sends it
+VALUES_PATH_PATTERN = re.compile(r'^/v4/spreadsheets/(?P<spreadsheet_id>[^/]+)/values(?::batchGet|/(?P<range>[^/]+))$')
+
+# A1 range such as "Collective Data!A2:Z" or "'Collective Data'!C5:C"
+A1_RANGE_PATTERN = re.compile(r'^(?:(?P<sheet>.+)!)?(?P<start_col>[A-Z]+)(?P<start_row>\d*)(?::(?P<end_col>[A-Z]+)(?P<end_row>\d*))?$')
+
+
+def column_index(letters):
+    """Convert a column letter like 'A' or 'AB' to a zero-based index"""
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+
+def parse_a1_range(a1_range):
+    """Split an A1 range into zero-based (first_row, last_row, first_col, last_col).
+
+    last_row is None when the range is open-ended.
+    """
+    match = A1_RANGE_PATTERN.match(a1_range)
+    if not match:
+        raise ValueError(f"Unsupported range: {a1_range}")
+
+    first_col = column_index(match.group('start_col'))
+    last_col = column_index(match.group('end_col') or match.group('start_col'))
+    first_row = int(match.group('start_row') or 1) - 1
+    if match.group('end_row'):
+        last_row = int(match.group('end_row')) - 1
+    elif match.group('end_col'):
+        last_row = None
+    else:
+        last_row = first_row
+    return first_row, last_row, first_col, last_col
+
+
+def unformat_value(value):
+    """Return numbers the way UNFORMATTED_VALUE does, leaving other text untouched"""
+    if not isinstance(value, str) or not value.strip():
+        return value
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    return int(number) if number.is_integer() and '.' not in value else number
+
+
+def trim_trailing(values, empty=''):
+    """Drop trailing empty cells, as the Sheets API does"""
+    end = len(values)
+    while end and values[end - 1] == empty:
+        end -= 1
+    return values[:end]
+
+
+class LocalRequest:
+    """Deferred call returned by the values resource, run with execute().
+
+    The response goes through a JSON body and postproc like an HTTP response would, so payload
+    size and decoding time are comparable with the real API.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.postproc = lambda resp, content: json.loads(content)
+
+    def execute(self, **kwargs):
+        content = json.dumps(self.handler()).encode('utf-8')
+        return self.postproc({'status': '200'}, content)
+
+
+class LocalValuesResource:
+    """values() resource reading from an in-memory grid of rows"""
+
+    def __init__(self, service):
+        self.service = service
+
+    def read_range(self, a1_range, major_dimension='ROWS', value_render_option=None):
+        """Get the cells of a range trimmed like the API, row- or column-major"""
+        first_row, last_row, first_col, last_col = parse_a1_range(a1_range)
+        grid = self.service.rows[first_row:None if last_row is None else last_row + 1]
+
+        rows = []
+        for row in grid:
+            cells = list(row[first_col:last_col + 1])
+            if value_render_option == 'UNFORMATTED_VALUE':
+                cells = [unformat_value(cell) for cell in cells]
+            rows.append(trim_trailing(cells))
+        rows = trim_trailing(rows, empty=[])
+
+        if major_dimension == 'COLUMNS':
+            width = last_col - first_col + 1
+            values = [
+                trim_trailing([row[i] if i < len(row) else '' for row in rows])
+                for i in range(width)
+            ]
+            return trim_trailing(values, empty=[])
+        return rows
+
+    def get_response(self, a1_range, major_dimension='ROWS', value_render_option=None):
+        """Body of a values.get response"""
+        values = self.read_range(a1_range, major_dimension, value_render_option)
+        self.service.record_call('get')
+        response = {'range': a1_range, 'majorDimension': major_dimension}
+        if values:
+            response['values'] = values
+        return response
+
+    def batch_get_response(self, spreadsheet_id, ranges, major_dimension='ROWS', value_render_option=None):
+        """Body of a values.batchGet response"""
+        value_ranges = []
+        for a1_range in ranges or []:
+            values = self.read_range(a1_range, major_dimension, value_render_option)
+            value_range = {'range': a1_range, 'majorDimension': major_dimension}
+            if values:
+                value_range['values'] = values
+            value_ranges.append(value_range)
+        self.service.record_call('batchGet')
+        return {'spreadsheetId': spreadsheet_id, 'valueRanges': value_ranges}
+
+    def get(self, spreadsheetId=None, range=None, majorDimension='ROWS', valueRenderOption=None, **kwargs):
+        return LocalRequest(lambda: self.get_response(range, majorDimension, valueRenderOption))
+
+    def batchGet(self, spreadsheetId=None, ranges=None, majorDimension='ROWS', valueRenderOption=None, **kwargs):
+        return LocalRequest(lambda: self.batch_get_response(spreadsheetId, ranges, majorDimension, valueRenderOption))
+
+
+class LocalSheetsService:
+    """Drop-in replacement for the object returned by build('sheets', 'v4', ...)"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+        self.calls_lock = threading.Lock()
+
+    @classmethod
+    def from_csv(cls, path):
+        """Load a sheet from a CSV file whose first row is the header"""
+        with open(path, newline='', encoding='utf-8') as csv_file:
+            return cls([row for row in csv.reader(csv_file)])
+
+    def record_call(self, method):
+        with self.calls_lock:
+            self.calls.append(method)
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return LocalValuesResource(self)
+
+
+class LocalSheetsServer(ThreadingHTTPServer):
+    """HTTP server for a LocalSheetsService, answering the URLs the googleapiclient builds.
+
+    Every API request first waits latency seconds plus up to latency_jitter more, and then
+    fails with failure_status instead of answering in a failure_rate fraction of cases. Call
+    counts are served as JSON at /stats and reset with a POST to /stats/reset.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, service, latency=0.0, latency_jitter=0.0, failure_rate=0.0,
+                 failure_status=503, seed=None):
+        super().__init__(address, LocalSheetsRequestHandler)
+        self.service = service
+        self.values = LocalValuesResource(service)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.random = random.Random(seed)
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = {
+                'requests': 0,
+                'get': 0,
+                'batchGet': 0,
+                'failures': 0,
+                'response_bytes': 0,
+                'in_flight': 0,
+                'max_in_flight': 0
+            }
+
+    def get_stats(self):
+        with self.stats_lock:
+            return dict(self.stats)
+
+    def serve_in_thread(self):
+        """Serve from a daemon thread and return it; stop with shutdown()"""
+        thread = threading.Thread(target=self.serve_forever, name='local-sheets-server', daemon=True)
+        thread.start()
+        return thread
+
+
+class LocalSheetsRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/stats':
+            self.send_json(200, self.server.get_stats())
+            return
+
+        match = VALUES_PATH_PATTERN.match(url.path)
+        if not match:
+            self.send_json(404, api_error(404, f'Unknown path {url.path}', 'NOT_FOUND'))
+            return
+
+        query = parse_qs(url.query)
+        major_dimension = query.get('majorDimension', ['ROWS'])[0]
+        value_render_option = query.get('valueRenderOption', [None])[0]
+        method = 'get' if match.group('range') else 'batchGet'
+
+        server = self.server
+        with server.stats_lock:
+            server.stats['requests'] += 1
+            server.stats[method] += 1
+            server.stats['in_flight'] += 1
+            server.stats['max_in_flight'] = max(server.stats['max_in_flight'], server.stats['in_flight'])
+        try:
+            with server.stats_lock:
+                delay = server.latency + server.random.random() * server.latency_jitter
+                fail = server.random.random() < server.failure_rate
+            if delay > 0:
+                time.sleep(delay)
+            if fail:
+                with server.stats_lock:
+                    server.stats['failures'] += 1
+                self.send_json(server.failure_status, api_error(server.failure_status, 'Injected failure', 'UNAVAILABLE'))
+                return
+
+            try:
+                if method == 'get':
+                    body = server.values.get_response(unquote(match.group('range')), major_dimension, value_render_option)
+                else:
+                    body = server.values.batch_get_response(match.group('spreadsheet_id'), query.get('ranges', []),
+                                                            major_dimension, value_render_option)
+            except ValueError as e:
+                self.send_json(400, api_error(400, str(e), 'INVALID_ARGUMENT'))
+                return
+            content_length = self.send_json(200, body)
+            with server.stats_lock:
+                server.stats['response_bytes'] += content_length
+        finally:
+            with server.stats_lock:
+                server.stats['in_flight'] -= 1
+
+    def do_POST(self):
+        if urlsplit(self.path).path == '/stats/reset':
+            self.server.reset_stats()
+            self.send_json(200, self.server.get_stats())
+        else:
+            self.send_json(404, api_error(404, f'Unknown path {self.path}', 'NOT_FOUND'))
+
+    def send_json(self, status, body):
+        """Send a JSON response and return its length in bytes"""
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+        return len(content)
+
+    def log_message(self, format, *args):
+        # Keep load tests quiet, failures are counted in the stats instead
+        pass
+
+
+def api_error(code, message, status):
+    """Error body in the shape the Google APIs use"""
+    return {'error': {'code': code, 'message': message, 'status': status}}
+
+
+def build_synthetic_service(rows, lanes, transporters, skew, seed):
+    """A LocalSheetsService over a synthetic sheet from the benchmark generator"""
+    import numpy as np
+    from benchmark import SHEET_HEADER, generate_lanes, generate_sheet_rows
+
+    rng = np.random.default_rng(seed)
+    lane_list = generate_lanes(lanes, rng)
+    # Cells are kept as text, as they would be read from a CSV fixture
+    sheet_rows = [[str(cell) for cell in row] for row in generate_sheet_rows(rows, lane_list, transporters, skew, rng)]
+    return LocalSheetsService([SHEET_HEADER] + sheet_rows), lane_list
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a local Sheets values API stand-in over HTTP')
+    parser.add_argument('--csv', help='Serve this CSV fixture instead of a synthetic sheet')
+    parser.add_argument('--rows', type=int, default=100000, help='Synthetic sheet rows')
+    parser.add_argument('--lanes', type=int, default=2000, help='Distinct ODVT lanes in the synthetic sheet')
+    parser.add_argument('--transporters', type=int, default=300, help='Distinct transporters in the synthetic sheet')
+    parser.add_argument('--skew', type=float, default=1.0, help='Zipf exponent of lane and transporter popularity')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8085)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every API call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many more seconds, uniformly random')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of API calls that fail')
+    parser.add_argument('--failure-status', type=int, default=503)
+    args = parser.parse_args()
+
+    if args.csv:
+        service = LocalSheetsService.from_csv(args.csv)
+    else:
+        service, _ = build_synthetic_service(args.rows, args.lanes, args.transporters, args.skew, args.seed)
+    server = LocalSheetsServer((args.host, args.port), service, latency=args.latency, latency_jitter=args.jitter,
+                               failure_rate=args.failure_rate, failure_status=args.failure_status, seed=args.seed)
+    print(f'Serving {len(service.rows) - 1} rows at {server.url}, set SHEETS_API_ENDPOINT to use it')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,502 @@
+"""Regression tests for app.py, run with `python -m pytest test_app.py`.
+
+The sheet is installed directly as a snapshot built from fixed rows, or read from a CSV
+fixture through the local Sheets stand-in, so no Sheets API access is needed.
+"""
+import csv
+import io
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pytest
+
+# app.py reads its configuration at import time
+os.environ['SHEET_SNAPSHOT_DIR'] = ''
+os.environ['SHEET_SNAPSHOT_SHARING'] = 'process'
+os.environ['SHEET_REFRESH_MODE'] = 'sync'
+os.environ['PROFILING'] = 'off'
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as prebid_app
+from local_sheets import LocalSheetsService
+
+SHEET_HEADER = list(prebid_app.REQUIRED_COLUMNS)
+UPLOAD_HEADER = ['Origin cluster name', 'Destination cluster name', 'Vehicle Type (New)', 'Shipper', 'Vehicle Type']
+CITIES = ['Pune', 'Mumbai', 'Delhi', 'Chennai', 'Nagpur']
+VEHICLE_TYPES = ['14ft', '19ft', '32ft SXL']
+# Shipper cells that are not positive numbers, skipped on both sides of the analysis
+INVALID_RATES = ['', 'abc', '0', '-500', 'nan']
+# Rating cells that are not numbers, stored as NaN since the columnar store
+INVALID_RATINGS = ['', 'n/a']
+EQUIVALENCE_SEEDS = [0, 1, 2, 7, 42]
+
+
+def use_sheet(rows):
+    """Install a sheet with the given rows, in SHEET_HEADER order, as the current snapshot"""
+    columns = {col_name: [row[i] for row in rows] for i, col_name in enumerate(SHEET_HEADER)}
+    store = prebid_app.build_benchmark_store(prebid_app.collect_sheet_columns(columns, prebid_app.REQUIRED_COLUMNS))
+    prebid_app.sheet_data_cache['snapshot'] = prebid_app.build_sheet_snapshot(store, None, time.time())
+    prebid_app.clear_sheet_memo()
+
+
+def csv_bytes(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    writer.writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+def random_rate(rng):
+    if rng.random() < 0.15:
+        return INVALID_RATES[rng.integers(len(INVALID_RATES))]
+    if rng.random() < 0.3:
+        return f'{rng.uniform(5000, 90000):.2f}'
+    return str(int(rng.integers(5000, 90000)))
+
+
+def random_lane(rng):
+    origin, destination = rng.choice(len(CITIES), size=2, replace=False)
+    return CITIES[origin], CITIES[destination], VEHICLE_TYPES[rng.integers(len(VEHICLE_TYPES))]
+
+
+def random_sheet_rows(rng, count):
+    rows = []
+    for _ in range(count):
+        if rng.random() < 0.1:
+            rating = INVALID_RATINGS[rng.integers(len(INVALID_RATINGS))]
+        else:
+            rating = str(int(rng.integers(1, 6)))
+        rows.append([*random_lane(rng), random_rate(rng), f'Transporter {rng.integers(8)}', rating])
+    return rows
+
+
+def random_upload_rows(rng, count):
+    rows = []
+    for _ in range(count):
+        origin, destination, vehicle_type = random_lane(rng)
+        if rng.random() < 0.1:
+            origin = f'Unlisted {origin}'
+        rows.append([origin, destination, vehicle_type, random_rate(rng), vehicle_type])
+    return rows
+
+
+def reference_analyze_rate_data(benchmark_rows, uploaded_rows):
+    """The row-by-row analyze_rate_data that the vectorized one replaced, over SHEET_HEADER and
+    UPLOAD_HEADER rows. The match-rate insight counts uploaded rows; the original reported the
+    field count of the last lane dict because a loop variable shadowed uploaded_data."""
+    def average_by_odvt(rows, columns):
+        lookup = {}
+        for row in rows:
+            row = dict(zip(columns, row))
+            lookup_key = f"{row.get('Origin cluster name')}|{row.get('Destination cluster name')}|{row.get('Vehicle Type (New)')}"
+            try:
+                shipper_rate = float(row.get('Shipper', 0))
+            except (ValueError, TypeError):
+                continue
+            if shipper_rate > 0:
+                if lookup_key in lookup:
+                    existing = lookup[lookup_key]
+                    existing['Shipper'] = (existing['Shipper'] * existing['count'] + shipper_rate) / (existing['count'] + 1)
+                    existing['count'] += 1
+                else:
+                    lookup[lookup_key] = {
+                        'Shipper': shipper_rate,
+                        'count': 1,
+                        'Origin cluster name': row.get('Origin cluster name'),
+                        'Destination cluster name': row.get('Destination cluster name'),
+                        'Vehicle Type (New)': row.get('Vehicle Type (New)')
+                    }
+        return lookup
+
+    uploaded_lookup = average_by_odvt(uploaded_rows, UPLOAD_HEADER)
+    benchmark_lookup = average_by_odvt(benchmark_rows, SHEET_HEADER)
+
+    results = {
+        'avg_uploaded_shipper': 0,
+        'avg_benchmark_shipper': 0,
+        'total_matches': 0,
+        'all_lane_differences': [],
+        'savings_percent': 0,
+        'savings_amount': 0,
+        'insights': []
+    }
+    total_uploaded = 0
+    total_benchmark = 0
+    for lookup_key, uploaded in uploaded_lookup.items():
+        if lookup_key not in benchmark_lookup:
+            continue
+        uploaded_avg = uploaded['Shipper']
+        benchmark_avg = benchmark_lookup[lookup_key]['Shipper']
+        total_uploaded += uploaded_avg
+        total_benchmark += benchmark_avg
+        results['total_matches'] += 1
+        diff_amount = uploaded_avg - benchmark_avg
+        results['all_lane_differences'].append({
+            'origin': uploaded['Origin cluster name'],
+            'destination': uploaded['Destination cluster name'],
+            'vehicle_type': uploaded['Vehicle Type (New)'],
+            'uploaded_rate': uploaded_avg,
+            'benchmark_rate': benchmark_avg,
+            'difference': diff_amount,
+            'difference_percent': diff_amount / uploaded_avg * 100,
+            'uploaded_count': uploaded['count'],
+            'benchmark_count': benchmark_lookup[lookup_key]['count']
+        })
+
+    if results['total_matches'] > 0:
+        results['avg_uploaded_shipper'] = total_uploaded / results['total_matches']
+        results['avg_benchmark_shipper'] = total_benchmark / results['total_matches']
+    if results['avg_uploaded_shipper'] > 0:
+        results['savings_amount'] = results['avg_uploaded_shipper'] - results['avg_benchmark_shipper']
+        results['savings_percent'] = results['savings_amount'] / results['avg_uploaded_shipper'] * 100
+    results['lane_differences'] = sorted(results['all_lane_differences'], key=lambda x: abs(x['difference']), reverse=True)[:5]
+
+    if results['savings_amount'] > 0:
+        results['insights'].append({
+            'type': 'positive',
+            'message': f"Overall potential savings of ₹{results['savings_amount']:,.2f} ({abs(results['savings_percent']):.2f}%) identified across all analyzed lanes."
+        })
+    else:
+        results['insights'].append({
+            'type': 'negative',
+            'message': f"Your rates are lower than benchmark by ₹{abs(results['savings_amount']):,.2f} ({abs(results['savings_percent']):.2f}%) across all analyzed lanes."
+        })
+    match_percent = (results['total_matches'] / len(uploaded_rows) * 100) if uploaded_rows else 0
+    results['insights'].append({
+        'type': 'neutral',
+        'message': f"Analysis matched {results['total_matches']} out of {len(uploaded_rows)} uploaded lanes ({match_percent:.2f}%)."
+    })
+    if results['lane_differences']:
+        top_lane = results['lane_differences'][0]
+        results['insights'].append({
+            'type': 'positive' if top_lane['difference'] > 0 else 'negative',
+            'message': f"Highest rate differential found on {top_lane['origin']} to {top_lane['destination']} lane with {top_lane['vehicle_type']} ({abs(top_lane['difference_percent']):.2f}% difference)."
+        })
+    positive_diffs = [lane for lane in results['all_lane_differences'] if lane['difference'] > 0]
+    negative_diffs = [lane for lane in results['all_lane_differences'] if lane['difference'] < 0]
+    if positive_diffs and negative_diffs:
+        pos_percent = len(positive_diffs) / len(results['all_lane_differences']) * 100
+        results['insights'].append({
+            'type': 'neutral',
+            'message': f"{len(positive_diffs)} lanes ({pos_percent:.1f}%) show potential savings, while {len(negative_diffs)} lanes have rates below benchmark."
+        })
+    if results['total_matches'] > 0:
+        avg_saving = results['savings_amount'] / results['total_matches']
+        results['insights'].append({
+            'type': 'positive' if avg_saving > 0 else 'negative',
+            'message': f"Average {'saving' if avg_saving > 0 else 'cost difference'} per lane: ₹{abs(avg_saving):,.2f}."
+        })
+    return results
+
+
+def assert_lanes_match(lanes, expected_lanes):
+    assert len(lanes) == len(expected_lanes)
+    for lane, expected in zip(lanes, expected_lanes):
+        assert lane.keys() == expected.keys()
+        for key, value in expected.items():
+            if isinstance(value, float):
+                assert lane[key] == pytest.approx(value, rel=1e-9, abs=1e-9), key
+            else:
+                assert lane[key] == value, key
+
+
+def assert_insights_match(insights, expected_insights):
+    """Insight amounts and percentages are the float results rounded to the nearest two decimals
+    by string formatting (one for the share of lanes with savings). Lane averages are sum / count
+    rather than running averages, so each number may differ by one unit in its last printed
+    digit, e.g. ₹0.01"""
+    number = re.compile(r'\d[\d,]*\.\d+')
+    assert [insight['type'] for insight in insights] == [insight['type'] for insight in expected_insights]
+    for insight, expected in zip(insights, expected_insights):
+        assert number.sub('#', insight['message']) == number.sub('#', expected['message'])
+        for value, expected_value in zip(number.findall(insight['message']), number.findall(expected['message'])):
+            digits = len(expected_value.split('.')[1])
+            assert abs(float(value.replace(',', '')) - float(expected_value.replace(',', ''))) <= 1.01 * 10 ** -digits
+
+
+@pytest.mark.parametrize('seed', EQUIVALENCE_SEEDS)
+def test_analyze_rate_data_matches_row_by_row_reference(seed):
+    rng = np.random.default_rng(seed)
+    sheet_rows = random_sheet_rows(rng, 400)
+    upload_rows = random_upload_rows(rng, 150)
+    use_sheet(sheet_rows)
+
+    upload = prebid_app.ingest_csv_upload(io.BytesIO(csv_bytes(UPLOAD_HEADER, upload_rows)))
+    results = prebid_app.analyze_rate_data(upload)
+    expected = reference_analyze_rate_data(sheet_rows, upload_rows)
+
+    assert results['total_matches'] == expected['total_matches'] > 0
+    for key in ['avg_uploaded_shipper', 'avg_benchmark_shipper', 'savings_amount', 'savings_percent']:
+        assert results[key] == pytest.approx(expected[key], rel=1e-9), key
+    assert_lanes_match(results['all_lane_differences'], expected['all_lane_differences'])
+    assert_lanes_match(results['lane_differences'], expected['lane_differences'])
+    assert_insights_match(results['insights'], expected['insights'])
+
+
+def test_non_numeric_rating_is_treated_as_missing():
+    """A rating cell such as 'n/a' is stored as NaN. The rate analysis still counts the row,
+    while the transporter analysis skips it like an empty rating, so it no longer adds a
+    zero-trip vehicle type row (the row-by-row version did)."""
+    use_sheet([
+        ['Pune', 'Mumbai', '19ft', '20000', 'Transporter 1', '4'],
+        ['Pune', 'Mumbai', '32ft SXL', '30000', 'Transporter 2', 'n/a']
+    ])
+
+    upload_rows = [['Pune', 'Mumbai', '32ft SXL', '33000', '32ft SXL']]
+    upload = prebid_app.ingest_csv_upload(io.BytesIO(csv_bytes(UPLOAD_HEADER, upload_rows)))
+    results = prebid_app.analyze_rate_data(upload)
+    assert results['total_matches'] == 1
+    assert results['all_lane_differences'][0]['benchmark_rate'] == 30000
+
+    analysis = prebid_app.get_lane_analysis('Pune', 'Mumbai')
+    assert [transporter['name'] for transporter in analysis['top_transporters']] == ['Transporter 1']
+    assert [summary['vehicle_type'] for summary in analysis['vehicle_type_summary']] == ['All Vehicle Types', '19ft']
+
+
+def restart_with_sheet(monkeypatch, snapshot_dir, sheet_id, fixture_path):
+    """Reset the process state as a restart would, configured for the given sheet and fixture"""
+    monkeypatch.setattr(prebid_app, 'SNAPSHOT_DIR', str(snapshot_dir))
+    monkeypatch.setattr(prebid_app, 'SHEET_ID', sheet_id)
+    monkeypatch.setattr(prebid_app, 'SHEET_NAME', 'Collective Data')
+    monkeypatch.setattr(prebid_app, 'SHEET_FIXTURE_CSV', str(fixture_path))
+    monkeypatch.setitem(prebid_app.sheet_data_cache, 'snapshot', None)
+    monkeypatch.setitem(prebid_app.sheet_data_cache, 'disk_checked', False)
+    monkeypatch.setitem(prebid_app.sheets_client, 'service', None)
+    prebid_app.clear_sheet_memo()
+
+
+def test_disk_snapshot_of_another_sheet_is_not_used(monkeypatch, tmp_path):
+    first_fixture = tmp_path / 'first.csv'
+    first_fixture.write_bytes(csv_bytes(SHEET_HEADER, [['Pune', 'Mumbai', '19ft', '20000', 'Transporter 1', '4']]))
+    second_fixture = tmp_path / 'second.csv'
+    second_fixture.write_bytes(csv_bytes(SHEET_HEADER, [['Delhi', 'Chennai', '14ft', '15000', 'Transporter 2', '3']]))
+    snapshot_dir = tmp_path / 'snapshot'
+
+    restart_with_sheet(monkeypatch, snapshot_dir, 'first-sheet', first_fixture)
+    assert prebid_app.get_sheet_snapshot()['source'] == 'sheets'
+    restart_with_sheet(monkeypatch, snapshot_dir, 'first-sheet', first_fixture)
+    assert prebid_app.get_sheet_snapshot()['source'] == 'disk'
+
+    restart_with_sheet(monkeypatch, snapshot_dir, 'second-sheet', second_fixture)
+    snapshot = prebid_app.get_sheet_snapshot()
+    assert snapshot['source'] == 'sheets'
+    assert list(snapshot['lane_index']) == ['Delhi']
+
+    # The same fixture under another sheet ID is another sheet too
+    restart_with_sheet(monkeypatch, snapshot_dir, 'third-sheet', second_fixture)
+    assert prebid_app.get_sheet_snapshot()['source'] == 'sheets'
+
+
+def wait_for_job(client, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        response = client.get(f'/analysis_jobs/{job_id}')
+        if response.status_code != 200 or response.get_json()['status'] in ('done', 'failed') or time.time() > deadline:
+            return response
+        time.sleep(0.01)
+
+
+def test_finished_job_results_share_the_upload_store_cap(monkeypatch):
+    rng = np.random.default_rng(3)
+    use_sheet(random_sheet_rows(rng, 400))
+    monkeypatch.setattr(prebid_app, 'upload_store', prebid_app.OrderedDict())
+    monkeypatch.setattr(prebid_app, 'upload_fingerprints', {})
+    monkeypatch.setattr(prebid_app, 'analysis_jobs', prebid_app.OrderedDict())
+    client = prebid_app.app.test_client()
+
+    job_ids = []
+    for _ in range(4):
+        upload_csv = csv_bytes(UPLOAD_HEADER, random_upload_rows(rng, 150))
+        response = client.post('/analyze_rates?async=1', data={'file': (io.BytesIO(upload_csv), 'rates.csv')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 202
+        job_ids.append(response.get_json()['job_id'])
+        assert wait_for_job(client, job_ids[-1]).get_json()['status'] == 'done'
+        if len(job_ids) == 1:
+            # Room for the results of two jobs
+            upload_size = next(iter(prebid_app.upload_store.values()))['size']
+            monkeypatch.setattr(prebid_app, 'UPLOAD_STORE_MAX_BYTES', int(upload_size * 2.5))
+
+    assert len(prebid_app.upload_store) == 2
+    for job_id in job_ids[:2]:
+        assert client.get(f'/analysis_jobs/{job_id}').status_code == 404
+        assert client.get(f'/analysis_jobs/{job_id}/results').status_code == 404
+    for job_id in job_ids[2:]:
+        assert client.get(f'/analysis_jobs/{job_id}/results').status_code == 200
+    assert list(prebid_app.analysis_jobs) == job_ids[2:]
+    assert all('results' not in job for job in prebid_app.analysis_jobs.values())
+
+
+@pytest.mark.parametrize('stack_interval, profiles_kept', [(0.001, 1), (1, 0)])
+def test_slow_request_profile_is_kept_only_with_stack_samples(monkeypatch, stack_interval, profiles_kept):
+    monkeypatch.setattr(prebid_app, 'PROFILING', 'on')
+    monkeypatch.setattr(prebid_app, 'PROFILE_SLOW_THRESHOLD', 0.05)
+    monkeypatch.setattr(prebid_app, 'PROFILE_STACK_INTERVAL', stack_interval)
+    monkeypatch.setattr(prebid_app, 'profile_store', prebid_app.OrderedDict())
+    render_metrics = prebid_app.render_metrics
+
+    def slow_render_metrics():
+        time.sleep(0.1)
+        return render_metrics()
+
+    monkeypatch.setattr(prebid_app, 'render_metrics', slow_render_metrics)
+    # Let a sampler thread left over from another test exit before the interval changes
+    while prebid_app.stack_sampler['thread'] is not None:
+        time.sleep(0.01)
+
+    assert prebid_app.app.test_client().get('/metrics').status_code == 200
+    profiles = list(prebid_app.profile_store.values())
+    assert len(profiles) == profiles_kept
+    for profile in profiles:
+        assert profile['sample_count'] > 0 and profile['data']
+
+
+def count_sheet_lookups():
+    stats = prebid_app.sheet_data_cache['stats']
+    return stats['hits'] + stats['stale_hits'] + stats['misses']
+
+
+def test_read_request_looks_up_the_sheet_once():
+    rng = np.random.default_rng(5)
+    use_sheet(random_sheet_rows(rng, 200))
+    client = prebid_app.app.test_client()
+    upload_csv = csv_bytes(UPLOAD_HEADER, random_upload_rows(rng, 50))
+    assert client.post('/analyze_rates', data={'file': (io.BytesIO(upload_csv), 'rates.csv')},
+                       content_type='multipart/form-data').status_code == 200
+
+    for path in ['/get_destinations/Pune', '/get_vehicle_types/Pune/Mumbai', '/get_transporter_analysis/Pune/Mumbai', '/lane_tree']:
+        for _ in range(2):
+            lookups = count_sheet_lookups()
+            assert client.get(path).status_code == 200
+            assert count_sheet_lookups() - lookups == 1, path
+
+
+def test_memoized_result_is_computed_from_the_snapshot_it_is_stored_under():
+    use_sheet([['Pune', 'Mumbai', '19ft', '20000', 'Transporter 1', '4']])
+    old_snapshot = prebid_app.sheet_data_cache['snapshot']
+    use_sheet([['Pune', 'Delhi', '19ft', '20000', 'Transporter 1', '4']])
+
+    assert prebid_app.get_destinations_for_origin('Pune', snapshot=old_snapshot) == ['Mumbai']
+    assert prebid_app.get_destinations_for_origin('Pune') == ['Delhi']
+
+
+def assert_snapshots_match(snapshot, expected):
+    """Check that two snapshots hold the same store, lane index, aggregates and version"""
+    store, expected_store = snapshot['data'], expected['data']
+    assert store['size'] == expected_store['size']
+    for col_name in prebid_app.TEXT_COLUMNS:
+        assert store['categories'][col_name].tolist() == expected_store['categories'][col_name].tolist()
+    for col_name in SHEET_HEADER:
+        np.testing.assert_array_equal(store['columns'][col_name], expected_store['columns'][col_name])
+
+    lane_index, expected_lane_index = snapshot['lane_index'], expected['lane_index']
+    assert list(lane_index) == list(expected_lane_index)
+    for origin, destinations in expected_lane_index.items():
+        assert list(lane_index[origin]) == list(destinations)
+        for destination, lane in destinations.items():
+            actual = lane_index[origin][destination]
+            np.testing.assert_array_equal(actual['positions'], lane['positions'])
+            assert sorted(actual['vehicle_types']) == sorted(lane['vehicle_types'])
+            for vehicle_type, positions in lane['vehicle_types'].items():
+                np.testing.assert_array_equal(actual['vehicle_types'][vehicle_type], positions)
+
+    prebid_app.pd.testing.assert_frame_equal(
+        snapshot['benchmark_aggregates'].sort_index(), expected['benchmark_aggregates'].sort_index(),
+        check_exact=False, rtol=1e-9
+    )
+    assert snapshot['version'] == expected['version']
+
+
+def fetch_from_local_sheet(monkeypatch, rows, previous_snapshot, fetch_mode):
+    monkeypatch.setattr(prebid_app, 'SHEET_FETCH_MODE', fetch_mode)
+    monkeypatch.setitem(prebid_app.sheets_client, 'service', LocalSheetsService([SHEET_HEADER] + rows))
+    monkeypatch.setitem(prebid_app.sheets_client, 'credentials', None)
+    return prebid_app.fetch_sheet_snapshot(previous_snapshot)
+
+
+@pytest.mark.parametrize('change, expected_kind', [('append', 'delta'), ('edit', 'full'), ('delete', 'full')])
+def test_delta_fetch_matches_full_rebuild(monkeypatch, change, expected_kind):
+    monkeypatch.setattr(prebid_app, 'SHEET_NAME', 'Collective Data')
+    rng = np.random.default_rng(11)
+    rows = random_sheet_rows(rng, 300)
+    previous_snapshot = fetch_from_local_sheet(monkeypatch, rows, None, 'full')
+
+    changed_rows = [list(row) for row in rows]
+    if change == 'append':
+        changed_rows += random_sheet_rows(rng, 40)
+    elif change == 'edit':
+        # Inside the SHEET_DELTA_OVERLAP rows that a delta fetch reads again
+        changed_rows[-10][3] = '123456'
+        changed_rows += random_sheet_rows(rng, 5)
+    else:
+        del changed_rows[100]
+        changed_rows += random_sheet_rows(rng, 5)
+
+    snapshot = fetch_from_local_sheet(monkeypatch, changed_rows, previous_snapshot, 'delta')
+    assert snapshot['fetch_state']['kind'] == expected_kind
+    assert_snapshots_match(snapshot, fetch_from_local_sheet(monkeypatch, changed_rows, None, 'full'))
+
+
+def test_shared_refresh_keeps_its_indexes_and_clear_cache_republishes(monkeypatch, tmp_path):
+    fixture = tmp_path / 'sheet.csv'
+    fixture.write_bytes(csv_bytes(SHEET_HEADER, [['Pune', 'Mumbai', '19ft', '20000', 'Transporter 1', '4']]))
+    restart_with_sheet(monkeypatch, tmp_path / 'snapshot', 'shared-sheet', fixture)
+    monkeypatch.setattr(prebid_app, 'SHEET_SNAPSHOT_SHARING', 'shared')
+    monkeypatch.setitem(prebid_app.sheet_data_cache, 'shared_checked', 0)
+    lane_index_builds = []
+    build_lane_index = prebid_app.build_lane_index
+    monkeypatch.setattr(prebid_app, 'build_lane_index', lambda *args: lane_index_builds.append(args) or build_lane_index(*args))
+
+    snapshot = prebid_app.get_sheet_snapshot()
+    assert snapshot['source'] == 'disk'
+    assert isinstance(snapshot['data']['columns']['Shipper'], np.memmap)
+    assert len(lane_index_builds) == 1
+    monkeypatch.setitem(prebid_app.sheet_data_cache, 'shared_checked', 0)
+    assert prebid_app.get_sheet_snapshot() is snapshot
+
+    # Another process would pick up what /clear_cache published
+    monkeypatch.setitem(prebid_app.sheets_client, 'service', LocalSheetsService(
+        [SHEET_HEADER, ['Delhi', 'Chennai', '14ft', '15000', 'Transporter 2', '3']]))
+    response = prebid_app.app.test_client().get('/clear_cache')
+    assert response.get_json()['scope'] == 'shared'
+    assert prebid_app.read_snapshot_pointer()['version'] != snapshot['version']
+    assert list(prebid_app.get_sheet_snapshot()['lane_index']) == ['Delhi']
+
+
+def test_failed_async_submit_deletes_the_spooled_upload(monkeypatch, tmp_path):
+    monkeypatch.setattr(prebid_app.tempfile, 'tempdir', str(tmp_path))
+
+    def fail_to_start(path, content_hash=None):
+        raise RuntimeError('executor is shut down')
+
+    monkeypatch.setattr(prebid_app, 'start_analysis_job', fail_to_start)
+    upload_csv = csv_bytes(UPLOAD_HEADER, [['Pune', 'Mumbai', '19ft', '20000', '19ft']])
+    response = prebid_app.app.test_client().post('/analyze_rates?async=1', data={'file': (io.BytesIO(upload_csv), 'rates.csv')},
+                                                 content_type='multipart/form-data')
+    assert response.status_code == 500
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_metric_label_values_are_escaped():
+    assert prebid_app.format_labels({'route': 'a\\b"c\nd', 'status': 200}) == '{route="a\\\\b\\"c\\nd",status="200"}'
+
+
+def test_lane_tree_counts_towards_the_upload_size():
+    rng = np.random.default_rng(9)
+    use_sheet(random_sheet_rows(rng, 200))
+    client = prebid_app.app.test_client()
+    upload_csv = csv_bytes(UPLOAD_HEADER, random_upload_rows(rng, 50))
+    assert client.post('/analyze_rates', data={'file': (io.BytesIO(upload_csv), 'rates.csv')},
+                       content_type='multipart/form-data').status_code == 200
+    with client.session_transaction() as flask_session:
+        upload = prebid_app.upload_store[flask_session['upload_id']]
+    size = upload['size']
+
+    lane_tree = client.get('/lane_tree').get_json()
+    assert sorted(lane_tree) == ['names', 'tree']
+    assert upload['size'] == size + prebid_app.approximate_size(upload['lane_tree'][1])
+    client.get('/lane_tree')
+    assert upload['size'] == size + upload['lane_tree'][2]